@@ -0,0 +1,226 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from loguru import logger
+from lxml import etree
+
+try:
+    # Optional, only to compare with the previous parsing
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+from douban.douban import DoubanMovieCrawler
+from douban.douban import DoubanMusicCrawler
+
+import fixtures
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.encoding = "utf-8"
+
+
+def parse_with_round_trip(crawler, content):
+    # The previous implementation: BeautifulSoup(lxml) -> str -> lxml
+    soup = BeautifulSoup(str(content, "UTF-8"), "lxml")
+    html = etree.HTML(str(soup).strip())
+    return crawler.parse_entry_details(html, "")
+
+
+def parse_in_single_pass(crawler, content):
+    html = crawler.parse_html(FakeResponse(content))
+    return crawler.parse_entry_details(html, "")
+
+
+def load_pages(pages_dir):
+    # The crawlers don't need a session to parse a page
+    movie_crawler = DoubanMovieCrawler.__new__(DoubanMovieCrawler)
+    music_crawler = DoubanMusicCrawler.__new__(DoubanMusicCrawler)
+    pages = []
+    if pages_dir is not None:
+        for file_path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+            with open(file_path, "rb") as file:
+                content = file.read()
+            crawler = music_crawler if "music" in file_path else movie_crawler
+            pages.append((os.path.basename(file_path), crawler, content))
+    else:
+        pages.append(
+            (
+                "movie",
+                movie_crawler,
+                fixtures.build_movie_subject_page(
+                    1, "电影", "tt0000001", ["剧情", "科幻"]
+                ).encode("utf-8"),
+            )
+        )
+        pages.append(
+            (
+                "series",
+                movie_crawler,
+                fixtures.build_movie_subject_page(
+                    2, "电视剧", "tt0000002", ["剧情"], episodes=12
+                ).encode("utf-8"),
+            )
+        )
+        pages.append(
+            (
+                "music",
+                music_crawler,
+                fixtures.build_music_subject_page(
+                    3, "专辑", "歌手", "0000000000003"
+                ).encode("utf-8"),
+            )
+        )
+    return pages
+
+
+PARSES = {"round_trip": parse_with_round_trip, "single": parse_in_single_pass}
+
+
+def measure_cpu(parse, crawler, content, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        result = parse(crawler, content)
+    cpu_ms = (time.process_time() - start) * 1000 / iterations
+    return result, cpu_ms
+
+
+# A process forked from this one inherits its peak RSS, which would hide the child's own.
+# So the child is started by a small launcher, which reports the peak RSS of the child after its own output.
+RSS_LAUNCHER = """
+import os, sys
+pid = os.posix_spawn(sys.argv[1], sys.argv[1:], os.environ)
+_, status, rusage = os.wait4(pid, 0)
+sys.stdout.flush()
+print(rusage.ru_maxrss)
+sys.exit(os.waitstatus_to_exitcode(status))
+"""
+
+
+def get_max_rss_kb(max_rss):
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    if sys.platform == "darwin":
+        return max_rss / 1024
+    return max_rss
+
+
+def measure_rss_in_child(file_path, crawler_name, parse_name):
+    # Run in its own process, so the peak RSS covers libxml2's memory and nothing left by the other parses
+    crawler_class = {
+        "movie": DoubanMovieCrawler,
+        "music": DoubanMusicCrawler,
+    }[crawler_name]
+    crawler = crawler_class.__new__(crawler_class)
+    with open(file_path, "rb") as file:
+        content = file.read()
+    baseline_kb = get_max_rss_kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    PARSES[parse_name](crawler, content)
+    print(json.dumps({"baseline_kb": baseline_kb}), flush=True)
+
+
+def measure_rss(crawler, content, parse_name):
+    # Returns how much parsing the page raised the peak RSS of a fresh process.
+    # The page is handed over in a file, building it in the child would raise the peak more than parsing it.
+    crawler_name = "music" if isinstance(crawler, DoubanMusicCrawler) else "movie"
+    with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as file:
+        file.write(content)
+    try:
+        r = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                RSS_LAUNCHER,
+                sys.executable,
+                os.path.abspath(__file__),
+                "--measure-rss",
+                "%s,%s,%s" % (file.name, crawler_name, parse_name),
+            ],
+            stdout=subprocess.PIPE,
+        )
+    finally:
+        os.remove(file.name)
+    if r.returncode != 0:
+        return float("nan")
+    lines = r.stdout.splitlines()
+    return get_max_rss_kb(int(lines[-1])) - json.loads(lines[-2])["baseline_kb"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the subject page parsing with and without the BeautifulSoup round trip."
+    )
+    parser.add_argument(
+        "--pages-dir",
+        help="A folder of saved subject pages (*.html), the music ones should have 'music' in their file names. Synthetic pages are used if not set.",
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--measure-rss", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logger.remove()
+
+    if args.measure_rss is not None:
+        file_path, crawler_name, parse_name = args.measure_rss.rsplit(",", 2)
+        measure_rss_in_child(file_path, crawler_name, parse_name)
+        return
+
+    if BeautifulSoup is None:
+        print(
+            "beautifulsoup4 is not installed, only the single-pass parsing is measured."
+        )
+
+    # The *_rss_kb columns are how much parsing the page once raises the peak RSS of a fresh process
+    print(
+        "%-24s %8s %14s %14s %17s %14s"
+        % (
+            "page",
+            "size_kb",
+            "round_trip_ms",
+            "single_ms",
+            "round_trip_rss_kb",
+            "single_rss_kb",
+        )
+    )
+    for name, crawler, content in load_pages(args.pages_dir):
+        result, single_ms = measure_cpu(
+            parse_in_single_pass, crawler, content, args.iterations
+        )
+        single_kb = measure_rss(crawler, content, "single")
+        round_trip_ms = round_trip_kb = float("nan")
+        if BeautifulSoup is not None:
+            legacy_result, round_trip_ms = measure_cpu(
+                parse_with_round_trip, crawler, content, args.iterations
+            )
+            round_trip_kb = measure_rss(crawler, content, "round_trip")
+            if legacy_result != result:
+                print(
+                    "Mismatched results for %s: %s != %s"
+                    % (name, legacy_result, result)
+                )
+        print(
+            "%-24s %8.1f %14.2f %14.2f %17.1f %14.1f"
+            % (
+                name,
+                len(content) / 1024,
+                round_trip_ms,
+                single_ms,
+                round_trip_kb,
+                single_kb,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
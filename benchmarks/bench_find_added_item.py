@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from loguru import logger
+
+from douban.records import EntryDetails
+from radarr.radarr import Radarr
+
+import stub_server
+
+
+def create_radarr(library_size):
+    # The library is indexed without a server, the same way as after loading it
+    radarr = Radarr.__new__(Radarr)
+    radarr.api_type = "movie"
+    radarr.added_items = [
+        {
+            "id": i + 1,
+            "title": stub_server.get_title(i),
+            "imdbId": stub_server.get_imdb_id(i),
+            "tags": [],
+        }
+        for i in range(library_size)
+    ]
+    started_at = time.perf_counter()
+    radarr.build_added_item_indexes()
+    return radarr, (time.perf_counter() - started_at) * 1000
+
+
+def find_by_scanning(radarr, caller_object_details):
+    # The previous implementation, checking every item of the library
+    external_id = caller_object_details.external_id.strip()
+    searching_titles = radarr.get_searching_titles(caller_object_details)
+    for item in radarr.added_items:
+        if radarr.is_any_matching(external_id, searching_titles, item):
+            return item
+    return None
+
+
+def measure(find, radarr, queries):
+    started_at = time.perf_counter()
+    for caller_object_details in queries:
+        find(radarr, caller_object_details)
+    return (time.perf_counter() - started_at) * 1000000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure Servarr.find_added_item against libraries of different sizes."
+    )
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument(
+        "--scan-queries",
+        type=int,
+        default=50,
+        help="How many queries are measured with the linear scan, it's slow on the large libraries.",
+    )
+    args = parser.parse_args()
+    logger.remove()
+
+    print(
+        "%10s %12s %14s %14s %14s %14s"
+        % ("library", "index_ms", "hit_id_us", "hit_title_us", "miss_us", "scan_us")
+    )
+    for library_size in [int(size) for size in args.sizes.split(",")]:
+        radarr, index_ms = create_radarr(library_size)
+        hits_by_id = [
+            EntryDetails(
+                external_id=stub_server.get_imdb_id(i * 7 % library_size),
+                titles=["其他标题"],
+            )
+            for i in range(args.queries)
+        ]
+        hits_by_title = [
+            EntryDetails(titles=[stub_server.get_title(i * 7 % library_size)])
+            for i in range(args.queries)
+        ]
+        misses = [
+            EntryDetails(
+                external_id=stub_server.get_imdb_id(library_size + i),
+                titles=[stub_server.get_title(library_size + i)],
+            )
+            for i in range(args.queries)
+        ]
+        find = lambda radarr, caller_object_details: radarr.find_added_item(
+            caller_object_details
+        )
+        print(
+            "%10d %12.1f %14.2f %14.2f %14.2f %14.2f"
+            % (
+                library_size,
+                index_ms,
+                measure(find, radarr, hits_by_id),
+                measure(find, radarr, hits_by_title),
+                measure(find, radarr, misses),
+                measure(find_by_scanning, radarr, misses[: args.scan_queries]),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
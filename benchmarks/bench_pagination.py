@@ -0,0 +1,68 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from loguru import logger
+
+from douban.douban import DoubanMovieCrawler
+from utils.rate_limiter import get_host_rate_limiter
+
+import stub_server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure DoubanCrawler.get_user_entry_lists against the local stub server."
+    )
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+    logger.remove()
+
+    print(
+        "%10s %8s %10s %12s %14s"
+        % ("entries", "pages", "total_s", "ms_per_page", "entries_per_s")
+    )
+    for list_size in [int(size) for size in args.sizes.split(",")]:
+        server = stub_server.StubServer(
+            stub_server.StubState(list_size=list_size, latency_ms=args.latency_ms)
+        ).start()
+        # Without the rate limit only the fetching and parsing is measured
+        get_host_rate_limiter(server.host, 1000000.0, 1000000)
+        crawler = DoubanMovieCrawler("movie", "", base_url=server.url)
+
+        started_at = time.perf_counter()
+        entry_lists = crawler.get_user_entry_lists(
+            "user1",
+            ["wish"],
+            start_date=stub_server.NEWEST_ADDED_DATE,
+            end_date=datetime.date(1970, 1, 1),
+            start_page=1,
+        )
+        total_secs = time.perf_counter() - started_at
+        server.stop()
+
+        entry_count = len(entry_lists.get("wish", []))
+        if entry_count != list_size:
+            print("Expected %d entries, got %d." % (list_size, entry_count))
+        page_count = -(-list_size // stub_server.ENTRIES_PER_PAGE)
+        print(
+            "%10d %8d %10.2f %12.2f %14.0f"
+            % (
+                list_size,
+                page_count,
+                total_secs,
+                total_secs * 1000 / page_count,
+                entry_count / total_secs,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
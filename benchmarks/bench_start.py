@@ -0,0 +1,217 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from loguru import logger
+
+from list_parser import ListParser
+from utils.persistent_cache import PersistentCache
+from utils.rate_limiter import get_host_rate_limiter
+
+import stub_server
+
+
+def create_list_parser(workdir, server, users, args):
+    # The same parameters create_bot builds from config.yml
+    servarr_config = {
+        "host": "127.0.0.1",
+        "port": server.server.server_address[1],
+        "url_base": "",
+        "api_key": "",
+        "https": False,
+        "library_cache_max_age_minutes": 0,
+        "rootFolderPath": "/",
+        "monitored": False,
+        "addOptions": {},
+        "qualityProfileId": 1,
+    }
+    return ListParser(
+        workdir=workdir,
+        douban={
+            "cookies": "",
+            "user_domain": users,
+            "start_date": stub_server.NEWEST_ADDED_DATE,
+            "end_date": datetime.date(1970, 1, 1),
+            "start_page": 1,
+            "categories": args.categories.split(","),
+            "list_types": ["wish"],
+            "instant_add": True,
+            "mode": "scrape_and_add",
+            "list_file_path": "",
+            "incremental": False,
+            "base_url": server.url,
+            "request_rate": 1000000.0,
+            "request_burst": 1000000,
+            "request_jitter_secs": 0.0,
+            "scrape_workers": args.scrape_workers,
+            "detail_workers": args.detail_workers,
+            "match_workers": args.match_workers,
+            "add_workers": args.add_workers,
+            "pipeline_queue_size": 100,
+            "match_list_entries": args.match_list_entries,
+            "subject_mappings_enabled": True,
+            "details_cache_enabled": False,
+            "details_cache_ttl_days": 30,
+            "details_cache_max_entries": 20000,
+        },
+        radarr=dict(servarr_config, minimumAvailability="released"),
+        sonarr=dict(
+            servarr_config,
+            external_id_cache_ttl_days=90,
+            external_id_cache_miss_ttl_hours=24,
+            languageProfileId=1,
+            seriesType="Standard",
+            addSeasonSubfolder=True,
+            genreSubfolderPath=[],
+        ),
+        lidarr=dict(
+            servarr_config,
+            musicbrainz_cache_ttl_days=90,
+            musicbrainz_cache_miss_ttl_hours=24,
+            musicbrainz_contact="",
+            metadataProfileId=1,
+        ),
+    )
+
+
+def seed_external_id_caches(workdir, state):
+    # Sonarr's and Lidarr's lookups on IMDb, TVDB and MusicBrainz are answered by their caches, as on the later runs
+    cache_dir = os.path.join(workdir, "cache")
+    sonarr_cache_file_path = os.path.join(cache_dir, "sonarr_external_ids.sqlite")
+    series_imdb_id_cache = PersistentCache(
+        sonarr_cache_file_path, table="series_imdb_ids"
+    )
+    tvdb_id_cache = PersistentCache(sonarr_cache_file_path, table="tvdb_ids")
+    release_group_cache = PersistentCache(
+        os.path.join(cache_dir, "musicbrainz.sqlite"), table="release_groups"
+    )
+    for i in range(state.list_start_index, state.list_start_index + state.list_size):
+        if state.is_series(i):
+            series_imdb_id = stub_server.get_series_imdb_id(i)
+            series_imdb_id_cache.set(series_imdb_id, series_imdb_id)
+            tvdb_id_cache.set(series_imdb_id, stub_server.get_tvdb_id(i))
+        release_group_cache.set(
+            "barcode:%s" % stub_server.get_barcode(i),
+            stub_server.get_release_group_id(i),
+        )
+    for cache in [series_imdb_id_cache, tvdb_id_cache, release_group_cache]:
+        cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure ListParser.start end to end against the local stub server."
+    )
+    parser.add_argument(
+        "--library-sizes",
+        default="1000,10000,100000",
+        help="The sizes of Radarr's, Sonarr's and Lidarr's libraries to run against.",
+    )
+    parser.add_argument(
+        "--categories",
+        default="movie,music",
+        help="The categories of the lists scraped for each user.",
+    )
+    parser.add_argument(
+        "--series-interval",
+        type=int,
+        default=5,
+        help="Every n-th entry of the movie lists is a series, 0 for none.",
+    )
+    parser.add_argument(
+        "--entries", type=int, default=300, help="The entries of each user's list."
+    )
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument(
+        "--latency-ms",
+        type=int,
+        default=0,
+        help="The latency added to every response of the stub server.",
+    )
+    parser.add_argument("--subject-size-kb", type=int, default=50)
+    parser.add_argument("--scrape-workers", type=int, default=2)
+    parser.add_argument("--detail-workers", type=int, default=4)
+    parser.add_argument("--match-workers", type=int, default=2)
+    parser.add_argument("--add-workers", type=int, default=1)
+    parser.add_argument(
+        "--no-match-list-entries",
+        dest="match_list_entries",
+        action="store_false",
+        help="Fetch the subject pages of the entries already in the library too.",
+    )
+    args = parser.parse_args()
+    logger.remove()
+
+    print(
+        "%10s %8s %10s %14s %10s %8s"
+        % ("library", "entries", "total_s", "entries_per_s", "requests", "added")
+    )
+    for library_size in [int(size) for size in args.library_sizes.split(",")]:
+        # Half of the entries are in the library already, the other half are added
+        server = stub_server.StubServer(
+            stub_server.StubState(
+                list_size=args.entries,
+                library_size=library_size,
+                latency_ms=args.latency_ms,
+                subject_size_in_kb=args.subject_size_kb,
+                list_start_index=max(0, library_size - args.entries // 2),
+                series_interval=args.series_interval,
+            )
+        ).start()
+        # Douban and the Servarr APIs are on the same stub, neither should be paced
+        get_host_rate_limiter(server.host, 1000000.0, 1000000)
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as workdir:
+            # The list files are written to the current directory
+            os.chdir(workdir)
+            try:
+                seed_external_id_caches(workdir, server.state)
+                list_parser = create_list_parser(
+                    workdir, server, ["user%d" % i for i in range(args.users)], args
+                )
+                started_at = time.perf_counter()
+                list_parser.start()
+                total_secs = time.perf_counter() - started_at
+                with open(
+                    glob.glob(os.path.join(workdir, "reports", "*.json"))[0]
+                ) as file:
+                    report = json.load(file)
+            finally:
+                os.chdir(cwd)
+        server.stop()
+
+        entry_count = args.entries * args.users * len(args.categories.split(","))
+        print(
+            "%10d %8d %10.2f %14.1f %10d %8d"
+            % (
+                library_size,
+                entry_count,
+                total_secs,
+                entry_count / total_secs,
+                server.state.request_count,
+                sum(len(items) for items in server.state.added_items.values()),
+            )
+        )
+        for api_type, items in sorted(server.state.added_items.items()):
+            print("%24s: %d added" % (api_type, len(items)))
+        for name, histogram in sorted(
+            report["histograms"].get("pipeline_stage_duration_seconds", {}).items()
+        ):
+            print(
+                "%24s: %d items, %.2f ms on average"
+                % (name, histogram["count"], histogram["average"] * 1000)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import random
+
+# Synthetic pages following the markup of Douban's pages, used when no saved pages are provided
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN" class="ua-windows ua-webkit">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+<title>%s (豆瓣)</title>
+<script type="text/javascript">%s</script>
+</head>
+<body>
+"""
+
+COMMENT_ITEM = """<div class="comment-item" data-cid="%d">
+<div class="avatar"><a title="用户%d" href="https://www.douban.com/people/user%d/"><img src="https://img1.doubanio.com/icon/u%d.jpg" class=""></a></div>
+<div class="comment"><h3><span class="comment-vote"><span class="votes vote-count">%d</span></span>
+<span class="comment-info"><a href="https://www.douban.com/people/user%d/" class="">用户%d</a><span class="allstar40 rating" title="推荐"></span>
+<span class="comment-time" title="2023-01-01 12:00:00">2023-01-01</span></span></h3>
+<p class="comment-content"><span class="short">%s</span></p></div>
+</div>
+"""
+
+COMMENT_TEXT = "这是一条用来填充页面的短评，内容和真实页面的长度差不多。"
+
+
+def build_padding(size_in_kb, seed):
+    rng = random.Random(seed)
+    items = []
+    size = 0
+    i = 0
+    while size < size_in_kb * 1024:
+        uid = rng.randint(1, 10**8)
+        item = COMMENT_ITEM % (
+            i,
+            uid,
+            uid,
+            uid,
+            rng.randint(0, 999),
+            uid,
+            uid,
+            COMMENT_TEXT * rng.randint(1, 4),
+        )
+        items.append(item)
+        size += len(item.encode("utf-8"))
+        i += 1
+    return '<div id="comments-section">%s</div>' % "".join(items)
+
+
+def build_movie_subject_page(id, title, imdb_id, genres, episodes=None, size_in_kb=200):
+    info = [
+        '<span><span class="pl">导演</span>: <span class="attrs"><a href="/celebrity/1000%s/" rel="v:directedBy">导演%s</a></span></span><br/>'
+        % (id, id),
+        '<span class="pl">类型:</span> %s<br/>'
+        % " / ".join('<span property="v:genre">%s</span>' % genre for genre in genres),
+        '<span class="pl">制片国家/地区:</span> 中国大陆<br/>',
+        '<span class="pl">语言:</span> 汉语普通话<br/>',
+    ]
+    if episodes is not None:
+        info.append('<span class="pl">集数:</span> %s<br/>' % episodes)
+    info.append('<span class="pl">IMDb:</span> %s<br/>' % imdb_id)
+    return (
+        PAGE_HEAD % (title, "var _CONFIG = {};" * 200)
+        + '<div id="wrapper"><div id="content">'
+        + '<h1><span property="v:itemreviewed">%s</span><span class="year">(2020)</span></h1>'
+        % title
+        + '<div class="subject clearfix"><div id="info">%s</div></div>'
+        % "\n".join(info)
+        + build_padding(size_in_kb, id)
+        + "</div></div></body></html>"
+    )
+
+
+def build_music_subject_page(id, title, artist, barcode, size_in_kb=200):
+    info = [
+        '<span class="pl"> 表演者: <span><a href="https://music.douban.com/musician/%s/">%s</a></span></span><br/>'
+        % (id, artist),
+        '<span class="pl">又名:</span> %s<br/>' % title.upper(),
+        '<span class="pl">流派:</span> 流行 Pop<br/>',
+        '<span class="pl">发行时间:</span> 2020-01-01<br/>',
+        '<span class="pl">出版者:</span> 唱片公司<br/>',
+        '<span class="pl">条形码:</span> %s<br/>' % barcode,
+    ]
+    return (
+        PAGE_HEAD % (title, "var _CONFIG = {};" * 200)
+        + '<div id="wrapper"><h1><span>%s</span></h1><div id="content">' % title
+        + '<div id="info">%s</div>' % "\n".join(info)
+        + build_padding(size_in_kb, id)
+        + "</div></div></body></html>"
+    )
+
+
+LIST_ITEM = """<div class="item comment-item">
+<div class="pic"><a title="%s" href="%s/subject/%s/" class="nbg"><img alt="%s" src="https://img1.doubanio.com/view/photo/s_ratio_poster/public/p%s.jpg" class=""></a></div>
+<div class="info"><ul>
+<li class="title"><a href="%s/subject/%s/" class=""><em>%s</em> / %s</a></li>
+<li class="intro">2020-01-01(中国大陆) / 演员甲 / 演员乙 / 中国大陆 / 导演丙 / 120分钟 / 剧情</li>
+<li><span class="rating4-t"></span><span class="date">%s</span></li>
+</ul></div>
+</div>
+"""
+
+
+def build_list_page(base_url, user, list_type, entries, next_href=None):
+    # entries: [(id, title, added_date_str)], the newest first
+    items = "".join(
+        LIST_ITEM
+        % (
+            title,
+            base_url,
+            id,
+            title,
+            id,
+            base_url,
+            id,
+            title,
+            "Title %s" % id,
+            added_date_str,
+        )
+        for id, title, added_date_str in entries
+    )
+    paginator = ""
+    if next_href is not None:
+        paginator = (
+            '<div class="paginator"><span class="prev">&lt;前页</span>'
+            '<span class="next"><link rel="next" href="%s"/><a href="%s">后页&gt;</a></span></div>'
+            % (next_href, next_href)
+        )
+    return PAGE_HEAD % (
+        "%s的%s" % (user, list_type),
+        "var _CONFIG = {};" * 20,
+    ) + '<div id="wrapper"><div id="content"><div class="grid-view">%s</div>%s</div></div></body></html>' % (
+        items,
+        paginator,
+    )
@@ -0,0 +1,356 @@
+import argparse
+import datetime
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import fixtures
+
+# A local stand-in for Douban and the Servarr APIs.
+# Douban's pages are served under /<category>, so the crawlers could use it as their base_url.
+# The entry i is the subject 1000000 + i. On the movie lists every series_interval-th entry is a series, the others are movies with the IMDb ID tt<i>.
+# On the music lists the entries are albums. Every list starts from the entry list_start_index.
+# Radarr's, Sonarr's and Lidarr's libraries each hold the items 0 to library_size - 1 of their kind, so the entries below library_size are in the libraries already.
+# IMDb, TVDB and MusicBrainz aren't served, the results of their lookups are get_series_imdb_id, get_tvdb_id and get_release_group_id.
+
+ENTRIES_PER_PAGE = 15
+NEWEST_ADDED_DATE = datetime.date(2024, 12, 31)
+
+
+class StubState:
+    def __init__(
+        self,
+        list_size=1000,
+        library_size=1000,
+        latency_ms=0,
+        subject_size_in_kb=50,
+        list_start_index=0,
+        series_interval=0,
+    ):
+        self.list_size = list_size
+        self.list_start_index = list_start_index
+        self.library_size = library_size
+        self.latency_secs = latency_ms / 1000
+        self.subject_size_in_kb = subject_size_in_kb
+        # 0 means there are no series on the movie lists
+        self.series_interval = series_interval
+        self.lock = threading.Lock()
+        self.tags = []
+        # Servarr's API type -> the items added through the stub
+        self.added_items = {api_type: [] for api_type in LIBRARY_ITEM_BUILDERS}
+        self.request_count = 0
+        self.libraries = {}
+        self.subject_pages = {}
+
+    def is_series(self, i):
+        return self.series_interval > 0 and i % self.series_interval == 0
+
+    def get_list_title(self, category, i):
+        if category == "music":
+            return get_album_title(i)
+        if self.is_series(i):
+            return get_series_title(i)
+        return get_title(i)
+
+    def get_library(self, api_type):
+        # The items added through the stub are in the library from then on
+        with self.lock:
+            if api_type not in self.libraries:
+                build_item = LIBRARY_ITEM_BUILDERS[api_type]
+                self.libraries[api_type] = json.dumps(
+                    [dict(build_item(i), id=i + 1) for i in range(self.library_size)]
+                ).encode("utf-8")
+            library = self.libraries[api_type]
+            if len(self.added_items[api_type]) == 0:
+                return library
+            added_items = json.dumps(self.added_items[api_type]).encode("utf-8")
+        if self.library_size == 0:
+            return added_items
+        return library[:-1] + b", " + added_items[1:]
+
+    def get_subject_page(self, category, id):
+        # The padding takes most of the time to build, the pages are the same for every run
+        key = (category, id)
+        if key not in self.subject_pages:
+            i = id - 1000000
+            if category == "music":
+                page = fixtures.build_music_subject_page(
+                    id,
+                    get_album_title(i),
+                    get_artist_name(i),
+                    get_barcode(i),
+                    size_in_kb=self.subject_size_in_kb,
+                )
+            elif self.is_series(i):
+                page = fixtures.build_movie_subject_page(
+                    id,
+                    get_series_title(i),
+                    get_series_imdb_id(i),
+                    ["剧情"],
+                    episodes=12,
+                    size_in_kb=self.subject_size_in_kb,
+                )
+            else:
+                page = fixtures.build_movie_subject_page(
+                    id,
+                    get_title(i),
+                    get_imdb_id(i),
+                    ["剧情"],
+                    size_in_kb=self.subject_size_in_kb,
+                )
+            self.subject_pages[key] = page.encode("utf-8")
+        return self.subject_pages[key]
+
+
+def get_title(i):
+    return "电影%s" % i
+
+
+def get_imdb_id(i):
+    return "tt%07d" % i
+
+
+def get_series_title(i):
+    return "剧集%s" % i
+
+
+def get_series_imdb_id(i):
+    return "tt%07d" % (9000000 + i)
+
+
+def get_tvdb_id(i):
+    return str(100000 + i)
+
+
+def get_album_title(i):
+    return "专辑%s" % i
+
+
+def get_artist_name(i):
+    return "歌手%s" % i
+
+
+def get_barcode(i):
+    return "%013d" % (6900000000000 + i)
+
+
+def get_release_group_id(i):
+    return "00000000-0000-4000-8000-%012d" % i
+
+
+def build_movie_item(i):
+    return {"title": get_title(i), "imdbId": get_imdb_id(i), "tags": []}
+
+
+def build_series_item(i):
+    return {
+        "title": get_series_title(i),
+        "imdbId": get_series_imdb_id(i),
+        "tvdbId": int(get_tvdb_id(i)),
+        "tags": [],
+    }
+
+
+def build_album_item(i):
+    return {
+        "title": get_album_title(i),
+        "foreignAlbumId": get_release_group_id(i),
+        "artist": {"artistName": get_artist_name(i)},
+        "tags": [],
+    }
+
+
+LIBRARY_ITEM_BUILDERS = {
+    "movie": build_movie_item,
+    "series": build_series_item,
+    "album": build_album_item,
+}
+
+# Servarr's lookup terms of the items, with the index of the item in their first group
+LOOKUP_TERM_PATTERNS = {
+    "movie": (r"imdb:tt(\d+)$", 0),
+    "series": (r"tvdb:(\d+)$", 100000),
+    "album": (r"lidarr:00000000-0000-4000-8000-(\d{12})$", 0),
+}
+
+
+def get_added_date(i):
+    return (NEWEST_ADDED_DATE - datetime.timedelta(days=i // 10)).strftime("%Y-%m-%d")
+
+
+def create_request_handler(state):
+    class StubRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are written separately, Nagle's algorithm would hold the body back on the kept-alive connections
+        disable_nagle_algorithm = True
+
+        def send_body(self, status_code, body=b"", content_type="application/json"):
+            self.send_response(status_code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status_code, content):
+            self.send_body(status_code, json.dumps(content).encode("utf-8"))
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length)) if length > 0 else None
+
+        def wait(self):
+            with state.lock:
+                state.request_count += 1
+            if state.latency_secs > 0:
+                time.sleep(state.latency_secs)
+
+        def do_GET(self):
+            self.wait()
+            url = urlparse(self.path)
+            if url.path.startswith("/api/"):
+                return self.get_servarr(url)
+            return self.get_douban(url)
+
+        def do_POST(self):
+            self.wait()
+            url = urlparse(self.path)
+            content = self.read_json()
+            if url.path.endswith("/tag"):
+                with state.lock:
+                    tag = {"id": len(state.tags) + 1, "label": content["label"]}
+                    state.tags.append(tag)
+                return self.send_json(201, tag)
+            api_type = url.path.rstrip("/").split("/")[-1]
+            with state.lock:
+                added_items = state.added_items[api_type]
+                content["id"] = state.library_size + len(added_items) + 1
+                added_items.append(content)
+            return self.send_json(201, content)
+
+        def do_PUT(self):
+            self.wait()
+            self.read_json()
+            return self.send_json(202, {})
+
+        def get_servarr(self, url):
+            if url.path.endswith("/tag"):
+                return self.send_json(200, state.tags)
+            found_api = re.match(r"/api/v\d+/(\w+)(/lookup)?/?$", url.path)
+            if found_api is None or found_api.group(1) not in LIBRARY_ITEM_BUILDERS:
+                return self.send_json(200, [])
+            api_type, is_lookup = found_api.groups()
+            if is_lookup is None:
+                return self.send_body(200, state.get_library(api_type))
+            term = parse_qs(url.query).get("term", [""])[0]
+            pattern, index_offset = LOOKUP_TERM_PATTERNS[api_type]
+            found_ids = re.match(pattern, term)
+            if found_ids is None:
+                return self.send_json(200, [])
+            i = int(found_ids.group(1)) - index_offset
+            return self.send_json(200, [LIBRARY_ITEM_BUILDERS[api_type](i)])
+
+        def get_douban(self, url):
+            found_list = re.match(r"/(\w+)/people/([^/]+)/(\w+)", url.path)
+            if found_list is not None:
+                category, user, list_type = found_list.groups()
+                start = int(parse_qs(url.query).get("start", ["0"])[0])
+                end = min(start + ENTRIES_PER_PAGE, state.list_size)
+                base_url = "http://%s/%s" % (self.headers["Host"], category)
+                next_href = None
+                if end < state.list_size:
+                    next_href = (
+                        "%s/people/%s/%s?start=%s&sort=time&rating=all&filter=all&mode=grid"
+                        % (base_url, user, list_type, end)
+                    )
+                page = fixtures.build_list_page(
+                    base_url,
+                    user,
+                    list_type,
+                    [
+                        (
+                            1000000 + state.list_start_index + i,
+                            state.get_list_title(category, state.list_start_index + i),
+                            get_added_date(i),
+                        )
+                        for i in range(start, end)
+                    ],
+                    next_href,
+                )
+                return self.send_body(
+                    200, page.encode("utf-8"), "text/html; charset=utf-8"
+                )
+            found_subject = re.match(r"/(\w+)/subject/(\d+)", url.path)
+            if found_subject is not None:
+                category, id = found_subject.groups()
+                page = state.get_subject_page(category, int(id))
+                return self.send_body(200, page, "text/html; charset=utf-8")
+            # The homepage
+            return self.send_body(200, b"<html></html>", "text/html; charset=utf-8")
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubRequestHandler
+
+
+class StubServer:
+    def __init__(self, state, port=0):
+        self.state = state
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", port), create_request_handler(state)
+        )
+        self.server.daemon_threads = True
+        self.host = "127.0.0.1:%s" % self.server.server_address[1]
+        self.url = "http://%s" % self.host
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve Douban's list and subject pages and the Servarr APIs locally."
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--list-size", type=int, default=1000)
+    parser.add_argument("--library-size", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--subject-size-kb", type=int, default=50)
+    parser.add_argument("--list-start-index", type=int, default=0)
+    parser.add_argument(
+        "--series-interval",
+        type=int,
+        default=0,
+        help="Every n-th entry of the movie lists is a series, 0 for none.",
+    )
+    args = parser.parse_args()
+
+    server = StubServer(
+        StubState(
+            args.list_size,
+            args.library_size,
+            args.latency_ms,
+            args.subject_size_kb,
+            args.list_start_index,
+            args.series_interval,
+        ),
+        args.port,
+    )
+    print("Douban's pages: base_url '%s'" % server.url)
+    print("Servarr APIs: host 127.0.0.1, port %s, url_base ''" % args.port)
+    server.start().thread.join()
+
+
+if __name__ == "__main__":
+    main()
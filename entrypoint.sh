@@ -12,6 +12,12 @@ if [ ! -f "$CONFIG_PATH" ]; then
     exit 1
 fi
 
+# Keep one process running and let it schedule the runs itself
+if [ "${RUN_MODE}" = "daemon" ]; then
+    cd /app
+    exec /usr/local/bin/python /app/src/__main__.py --daemon
+fi
+
 # Configure the cron job
 echo "${DOWNLOAD_CRON} cd /app && /usr/local/bin/python /app/src/__main__.py >> /var/log/cron.log 2>&1" > /etc/cron.d/download-cron
 chmod 0644 /etc/cron.d/download-cron
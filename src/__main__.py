@@ -1,10 +1,14 @@
+import argparse
 import os
+import signal
 import sys
+import time
 import datetime
 from zoneinfo import ZoneInfo
 import yaml
 from loguru import logger
 from list_parser import ListParser
+from utils.metrics import start_metrics_server
 
 
 def is_running_in_docker():
@@ -43,7 +47,7 @@ def load_user_config():
     return None
 
 
-def create_bot(user_config, workdir):
+def get_scraping_dates(user_config):
     max_scraping_days = user_config["douban"]["max_scraping_days"]
     start_date = user_config["douban"]["start_date"]
     if start_date == "today":
@@ -55,6 +59,11 @@ def create_bot(user_config, workdir):
             end_date = datetime.date(1970, 1, 1)
     else:
         end_date = start_date - datetime.timedelta(days=max_scraping_days)
+    return start_date, end_date
+
+
+def create_bot(user_config, workdir):
+    start_date, end_date = get_scraping_dates(user_config)
 
     list_file_path = ""
     mode = user_config["douban"]["mode"]
@@ -79,6 +88,33 @@ def create_bot(user_config, workdir):
             "instant_add": user_config["douban"]["instant_add"],
             "mode": user_config["douban"]["mode"],
             "list_file_path": list_file_path,
+            "incremental": user_config["douban"].get("incremental", True),
+            "base_url": user_config["douban"].get("base_url", ""),
+            "request_rate": user_config["douban"].get("request_rate", 0.2),
+            "request_burst": user_config["douban"].get("request_burst", 1),
+            "request_jitter_secs": user_config["douban"].get(
+                "request_jitter_secs", 2.0
+            ),
+            "scrape_workers": user_config["douban"].get("scrape_workers", 2),
+            "detail_workers": user_config["douban"].get("detail_workers", 4),
+            "match_workers": user_config["douban"].get("match_workers", 2),
+            "add_workers": user_config["douban"].get("add_workers", 1),
+            "pipeline_queue_size": user_config["douban"].get(
+                "pipeline_queue_size", 100
+            ),
+            "match_list_entries": user_config["douban"].get("match_list_entries", True),
+            "subject_mappings_enabled": user_config["douban"].get(
+                "subject_mappings_enabled", True
+            ),
+            "details_cache_enabled": user_config["douban"].get(
+                "details_cache_enabled", True
+            ),
+            "details_cache_ttl_days": user_config["douban"].get(
+                "details_cache_ttl_days", 30
+            ),
+            "details_cache_max_entries": user_config["douban"].get(
+                "details_cache_max_entries", 20000
+            ),
         },
         "radarr": {
             "host": user_config["radarr"]["host"],
@@ -86,6 +122,9 @@ def create_bot(user_config, workdir):
             "url_base": user_config["radarr"]["url_base"],
             "api_key": user_config["radarr"]["api_key"],
             "https": user_config["radarr"]["https"],
+            "library_cache_max_age_minutes": user_config["radarr"].get(
+                "library_cache_max_age_minutes", 60
+            ),
             "rootFolderPath": user_config["radarr"]["rootFolderPath"],
             "monitored": user_config["radarr"]["monitored"],
             "qualityProfileId": user_config["radarr"]["qualityProfileId"],
@@ -98,6 +137,15 @@ def create_bot(user_config, workdir):
             "url_base": user_config["sonarr"]["url_base"],
             "api_key": user_config["sonarr"]["api_key"],
             "https": user_config["sonarr"]["https"],
+            "library_cache_max_age_minutes": user_config["sonarr"].get(
+                "library_cache_max_age_minutes", 60
+            ),
+            "external_id_cache_ttl_days": user_config["sonarr"].get(
+                "external_id_cache_ttl_days", 90
+            ),
+            "external_id_cache_miss_ttl_hours": user_config["sonarr"].get(
+                "external_id_cache_miss_ttl_hours", 24
+            ),
             "rootFolderPath": user_config["sonarr"]["rootFolderPath"],
             "monitored": user_config["sonarr"]["monitored"],
             "addOptions": user_config["sonarr"]["addOptions"],
@@ -113,6 +161,16 @@ def create_bot(user_config, workdir):
             "url_base": user_config["lidarr"]["url_base"],
             "api_key": user_config["lidarr"]["api_key"],
             "https": user_config["lidarr"]["https"],
+            "library_cache_max_age_minutes": user_config["lidarr"].get(
+                "library_cache_max_age_minutes", 60
+            ),
+            "musicbrainz_cache_ttl_days": user_config["lidarr"].get(
+                "musicbrainz_cache_ttl_days", 90
+            ),
+            "musicbrainz_cache_miss_ttl_hours": user_config["lidarr"].get(
+                "musicbrainz_cache_miss_ttl_hours", 24
+            ),
+            "musicbrainz_contact": user_config["lidarr"].get("musicbrainz_contact", ""),
             "rootFolderPath": user_config["lidarr"]["rootFolderPath"],
             "monitored": user_config["lidarr"]["monitored"],
             "addOptions": user_config["lidarr"]["addOptions"],
@@ -123,7 +181,40 @@ def create_bot(user_config, workdir):
     return ListParser(**params)
 
 
+def run_daemon(bot, user_config, interval_minutes):
+    # The bot is kept between the runs, so are its sessions, caches and the Servarr libraries
+    logger.info("Running as a daemon, every {} minutes.", interval_minutes)
+    while True:
+        started_at = time.monotonic()
+        # "today" has to be recomputed for every run
+        start_date, end_date = get_scraping_dates(user_config)
+        bot.douban_config["start_date"] = start_date
+        bot.douban_config["end_date"] = end_date
+        try:
+            bot.start()
+        except Exception as e:
+            logger.exception("The run failed: {}", e)
+
+        wait_secs = started_at + interval_minutes * 60 - time.monotonic()
+        if wait_secs > 0:
+            logger.info(
+                "The next run starts at {}.",
+                (
+                    datetime.datetime.now() + datetime.timedelta(seconds=wait_secs)
+                ).strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            time.sleep(wait_secs)
+
+
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and start a new run every daemon_interval_minutes",
+    )
+    args = arg_parser.parse_args()
+
     user_config = load_user_config()
     if user_config is None:
         sys.exit()
@@ -157,7 +248,19 @@ if __name__ == "__main__":
     # Create and start the bot
     bot = create_bot(user_config, os.getcwd())
     if bot:
-        bot.start()
+        if args.daemon:
+            # "docker stop" sends SIGTERM, the interrupted run would be resumed from its checkpoint
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            metrics_port = user_config["global"].get("metrics_port", 0)
+            if metrics_port > 0:
+                start_metrics_server(metrics_port)
+            run_daemon(
+                bot,
+                user_config,
+                user_config["global"].get("daemon_interval_minutes", 120),
+            )
+        else:
+            bot.start()
     else:
         logger.error(
             "Something isn't correct, please check the console output for the details."
@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+import threading
+
+from douban.records import EntryDetails
+from douban.records import UserEntry
+from douban.records import to_json_value
+from utils.file_utils import make_parent_dirs
+
+
+class Checkpoint:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        # list_type -> {"entries": [...], "uri": the next page to scrape, "scraped": bool}
+        # Only the entries of the interrupted run are kept, until they're taken to be processed again
+        self.lists = {}
+        # list_type -> {id: where its details are in the journal}, the details themselves are read back when needed
+        self.detail_offsets = {}
+        # list_type -> ids
+        self.added_ids = {}
+        self.file = None
+        self.is_resumed = False
+
+        if os.path.exists(self.file_path):
+            self.load()
+
+    def load(self):
+        with open(self.file_path, "rb") as file:
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if line == b"":
+                    break
+                line = line.strip()
+                if line == b"":
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line could have been cut off by the crash
+                    continue
+                if record["event"] == "detailed":
+                    # Left in the journal until it's needed
+                    record["details"] = None
+                self.apply(read_record(record), offset)
+        self.is_resumed = True
+
+    def apply(self, record, offset=None):
+        # offset is where a loaded record is in the journal, None for the records written by this run
+        list_type = record["list_type"]
+        event = record["event"]
+        if event == "page":
+            checkpoint_list = self.get_list(list_type)
+            if offset is not None:
+                checkpoint_list["entries"].extend(record["entries"])
+            checkpoint_list["uri"] = record["uri"]
+            if record["uri"] is None:
+                checkpoint_list["scraped"] = True
+        elif event == "scraped":
+            self.get_list(list_type)["scraped"] = True
+        elif event == "detailed":
+            if offset is not None:
+                self.detail_offsets.setdefault(list_type, {})[record["id"]] = offset
+        elif event == "added":
+            self.added_ids.setdefault(list_type, set()).add(record["id"])
+
+    def write(self, record):
+        with self.lock:
+            self.apply(record)
+            if self.file is None:
+                make_parent_dirs(self.file_path)
+                self.file = open(self.file_path, "a", encoding="utf-8")
+            self.file.write(
+                json.dumps(record, ensure_ascii=False, default=to_json_value) + "\n"
+            )
+            self.file.flush()
+
+    def get_list(self, list_type):
+        if list_type not in self.lists:
+            self.lists[list_type] = {"entries": [], "uri": None, "scraped": False}
+        return self.lists[list_type]
+
+    def take_entries(self, list_type):
+        # The entries of the interrupted run, handed over only once
+        checkpoint_list = self.get_list(list_type)
+        entries = checkpoint_list["entries"]
+        checkpoint_list["entries"] = []
+        return entries
+
+    def get_details(self, list_type, id):
+        # The details recorded by the interrupted run, None if it didn't get to them
+        offset = self.detail_offsets.get(list_type, {}).get(id)
+        if offset is None:
+            return None
+        with self.lock:
+            with open(self.file_path, "rb") as file:
+                file.seek(offset)
+                record = json.loads(file.readline())
+        return read_record(record)["details"]
+
+    def is_added(self, list_type, id):
+        return id in self.added_ids.get(list_type, set())
+
+    def record_page(self, list_type, uri, entries):
+        self.write(
+            {"event": "page", "list_type": list_type, "uri": uri, "entries": entries}
+        )
+
+    def record_details(self, list_type, id, entry_details):
+        self.write(
+            {
+                "event": "detailed",
+                "list_type": list_type,
+                "id": id,
+                "details": entry_details,
+            }
+        )
+
+    def record_added(self, list_type, id):
+        self.write({"event": "added", "list_type": list_type, "id": id})
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def complete(self):
+        # Everything is done, the next run starts from scratch
+        self.close()
+        with self.lock:
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+
+
+def read_record(record):
+    # The entries are saved as JSON objects, and kept as records in memory
+    record["list_type"] = sys.intern(record["list_type"])
+    if record["event"] == "page":
+        record["entries"] = [UserEntry.from_dict(entry) for entry in record["entries"]]
+    elif record["event"] == "detailed" and record["details"] is not None:
+        record["details"] = EntryDetails.from_dict(record["details"])
+    return record
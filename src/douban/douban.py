@@ -1,25 +1,51 @@
 import datetime
 import html
 import re
+import time
 
 import cn2an
 from lxml import etree
 from loguru import logger
-from bs4 import BeautifulSoup
 
+from douban.records import EntryDetails
+from douban.records import UserEntry
+from douban.records import split_titles
+from utils.metrics import metrics
 from utils.request_utils import RequestUtils
+from utils.retry_policy import RetryPolicy
 
 
 class DoubanCrawler:
-    def __init__(self, category, cookies):
+    def __init__(
+        self,
+        category,
+        cookies,
+        details_cache=None,
+        request_rate=0.2,
+        request_burst=1,
+        request_jitter_secs=0.0,
+        base_url="",
+    ):
         self.category = category
-        self.url = "https://%s.douban.com" % self.category
+        self.details_cache = details_cache
+        self.host = "%s.douban.com" % self.category
+        self.url = "https://%s" % self.host
+        if base_url != "":
+            # E.g. a local stand-in serving the pages under http://127.0.0.1:8000/movie
+            self.url = "%s/%s" % (base_url.rstrip("/"), self.category)
         self.headers = {
             "Referer": self.url,
             "Accept-Encoding": "gzip",
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
         }
-        self.request_wrapper = RequestUtils(request_interval_mode=True)
+        self.request_wrapper = RequestUtils(
+            request_interval_mode=True,
+            request_rate=request_rate,
+            request_burst=request_burst,
+            request_jitter_secs=request_jitter_secs,
+            # Douban answers a client it has banned with 403 or 418, asking again would only extend the ban
+            retry_policy=RetryPolicy(failure_status_codes=(403, 418)),
+        )
 
         # Initialize the session
         initial_headers = self.headers
@@ -35,8 +61,16 @@ class DoubanCrawler:
         else:
             return cn2an.cn2an(str)
 
+    def parse_html(self, res):
+        # Parse the raw bytes only once and let libxml2 decode them, instead of building the text and another tree from it
+        parser = etree.HTMLParser(encoding=res.encoding or "utf-8")
+        return etree.fromstring(res.content, parser)
+
     def request_get(self, url, headers):
         res = self.request_wrapper.get(url=url, headers=headers)
+        return self.check_response(res, url)
+
+    def check_response(self, res, url):
         if res == None:
             logger.error("Bad result returned when requesting {}.", url)
             return None
@@ -46,111 +80,188 @@ class DoubanCrawler:
         return res
 
     def get_user_entry_lists(
-        self, user, list_types, start_date, end_date, start_page
+        self, user, list_types, start_date, end_date, start_page, scraping_state=None
     ) -> object:
         entry_lists = {}
         for list_type in list_types:
-            logger.info(
-                'Start to scrape list "{}" for {} on {}, from {} to {}.',
-                list_type,
-                user,
-                self.url,
-                start_date,
-                end_date,
+            entry_list = list(
+                self.iterate_user_entries(
+                    user, list_type, start_date, end_date, start_page, scraping_state
+                )
             )
-            offset = (start_page - 1) * 15
-            uri = "/people/%s/%s?start=%s&sort=time&rating=all&filter=all&mode=grid" % (
-                user,
-                list_type,
-                offset,
+            if len(entry_list) > 0:
+                entry_lists[list_type] = entry_list
+        return entry_lists
+
+    def iterate_user_entries(
+        self,
+        user,
+        list_type,
+        start_date,
+        end_date,
+        start_page,
+        scraping_state=None,
+        start_uri=None,
+        page_callback=None,
+    ):
+        logger.info(
+            'Start to scrape list "{}" for {} on {}, from {} to {}.',
+            list_type,
+            user,
+            self.url,
+            start_date,
+            end_date,
+        )
+        offset = (start_page - 1) * 15
+        uri = "/people/%s/%s?start=%s&sort=time&rating=all&filter=all&mode=grid" % (
+            user,
+            list_type,
+            offset,
+        )
+        if start_uri is not None:
+            # Resuming from the page an earlier run stopped at
+            uri = start_uri
+        page_count = 1
+        entry_count = 0
+        turn_page = True
+        while uri is not None:
+            # The next page href is not consistent on different category's pages
+            if self.url in uri:
+                url = uri
+            else:
+                url = self.url + uri
+            res = self.request_get(url, headers=self.headers)
+            if res == None:
+                # The request has been retried already, the rest of the list is left for the next run
+                logger.error(
+                    'Stopped scraping list "{}" for {} at {}.', list_type, user, url
+                )
+                break
+            metrics.increase("douban_pages_total", category=self.category, kind="list")
+            parse_started_at = time.perf_counter()
+            html = self.parse_html(res)
+            if html is None:
+                logger.warning("Unable to parse {}.", url)
+                break
+            page = html.xpath('//div[@class="paginator"]/span[@class="next"]/a')
+            if len(page) > 0:
+                uri = page[0].attrib["href"]
+            else:
+                uri = None
+            entry_list_url = html.xpath('//li[@class="title"]/a[1]/@href')
+            added_date_list = html.xpath('//li/span[@class="date"]/text()')
+            entry_list_a = html.xpath('//li[@class="title"]/a/em')
+            metrics.observe(
+                "douban_parse_duration_seconds",
+                time.perf_counter() - parse_started_at,
+                category=self.category,
+                kind="list",
             )
-            page_count = 1
-            entry_list = []
-            turn_page = True
-            while uri is not None:
-                # The next page href is not consistent on different category's pages
-                if self.url in uri:
-                    url = uri
-                else:
-                    url = self.url + uri
-                res = self.request_get(url, headers=self.headers)
-                if res == None:
+            for i in range(len(entry_list_a)):
+                added_date_str = added_date_list[i]
+                added_date = datetime.datetime.strptime(
+                    added_date_str, "%Y-%m-%d"
+                ).date()
+                if added_date > start_date:
+                    continue
+                if added_date < end_date:
+                    turn_page = False
                     continue
-                html = etree.HTML(res.text)
-                page = html.xpath('//div[@class="paginator"]/span[@class="next"]/a')
-                if len(page) > 0:
-                    uri = page[0].attrib["href"]
+                url = entry_list_url[i]
+                found_ids = re.search(r"/subject/(\d+)", url)
+                if found_ids:
+                    id = found_ids.group(1).strip()
                 else:
-                    uri = None
-                entry_list_url = html.xpath('//li[@class="title"]/a[1]/@href')
-                added_date_list = html.xpath('//li/span[@class="date"]/text()')
-                entry_list_a = html.xpath('//li[@class="title"]/a/em')
-                for i in range(len(entry_list_a)):
-                    added_date_str = added_date_list[i]
-                    added_date = datetime.datetime.strptime(
-                        added_date_str, "%Y-%m-%d"
-                    ).date()
-                    if added_date > start_date:
-                        continue
-                    if added_date < end_date:
+                    id = None
+                if scraping_state is not None:
+                    if scraping_state.is_scraped_before(
+                        user, self.category, list_type, added_date_str
+                    ):
+                        logger.info(
+                            'Reached the already scraped entries of list "{}" for {}.',
+                            list_type,
+                            user,
+                        )
                         turn_page = False
+                        break
+                    if scraping_state.is_seen(user, self.category, list_type, id):
                         continue
-                    url = entry_list_url[i]
-                    titles = entry_list_a[i].text.split(" / ")
-                    if entry_list_a[i].tail is not None:
-                        alternative_titles = entry_list_a[i].tail.strip().split(" / ")
-                        if (
-                            alternative_titles is not None
-                            and len(alternative_titles) > 0
-                        ):
-                            # Remove "/ "
-                            alternative_titles[0] = alternative_titles[0][
-                                2 : len(alternative_titles[0])
-                            ]
-                            titles.extend(alternative_titles)
-                    found_ids = re.search(r"/subject/(\d+)", url)
-                    if found_ids:
-                        id = found_ids.group(1)
-                    else:
-                        id = None
-                    entry_list.append(
-                        {
-                            "id": id.strip(),
-                            "titles": titles,
-                            "url": url,
-                            "added_date": added_date_str,
-                        }
-                    )
-                if not turn_page:
-                    break
-                if uri is not None:
-                    logger.info(
-                        "Page {} has been scraped, moving to the next one...",
-                        start_page - 1 + page_count,
-                    )
-                    page_count = page_count + 1
-            if len(entry_list) > 0:
-                entry_lists[list_type] = entry_list
-            logger.info("Total scraped entries: {} on {}.", len(entry_list), self.url)
-        return entry_lists
+                titles = entry_list_a[i].text.split(" / ")
+                if entry_list_a[i].tail is not None:
+                    alternative_titles = entry_list_a[i].tail.strip().split(" / ")
+                    if alternative_titles is not None and len(alternative_titles) > 0:
+                        # Remove "/ "
+                        alternative_titles[0] = alternative_titles[0][
+                            2 : len(alternative_titles[0])
+                        ]
+                        titles.extend(alternative_titles)
+                entry_count += 1
+                yield UserEntry(id, titles, url, added_date.toordinal())
+            # Called with the next page to scrape, or None if it's the last page
+            if page_callback is not None:
+                page_callback(uri if turn_page else None)
+            if not turn_page:
+                break
+            if uri is not None:
+                logger.info(
+                    "Page {} has been scraped, moving to the next one...",
+                    start_page - 1 + page_count,
+                )
+                page_count = page_count + 1
+        logger.info("Total scraped entries: {} on {}.", entry_count, self.url)
 
     def get_details_by_id(self, id):
-        return self.get_entry_details("%s/subject/%s" % (self.url, id))
+        cached_details = self.get_cached_details(id)
+        if cached_details is not None:
+            return cached_details
 
-    def get_entry_details(self, url):
-        return None
+        entry_details = self.get_entry_details("%s/subject/%s" % (self.url, id))
+        self.cache_details(id, entry_details)
+        return entry_details
+
+    def get_cached_details(self, id):
+        if self.details_cache is None:
+            return None
+        cached_details = self.details_cache.get(id)
+        if cached_details is None:
+            return None
+        logger.info("Loaded the details of {} from the cache.", id)
+        metrics.increase("douban_details_cache_hits_total", category=self.category)
+        return EntryDetails.from_dict(cached_details)
 
+    def cache_details(self, id, entry_details):
+        if entry_details is not None and self.details_cache is not None:
+            self.details_cache.set(id, entry_details.to_dict())
 
-class DoubanMovieCrawler(DoubanCrawler):
     def get_entry_details(self, url):
         res = self.request_get(url, headers=self.headers)
+        return self.parse_entry_details_response(res, url)
+
+    def parse_entry_details_response(self, res, url):
         if res == None:
             return None
 
-        text = res.text
-        soup = BeautifulSoup(text, "lxml")
-        html = etree.HTML(str(soup).strip())
+        metrics.increase("douban_pages_total", category=self.category, kind="subject")
+        parse_started_at = time.perf_counter()
+        html = self.parse_html(res)
+        if html is None:
+            logger.warning("Unable to parse {}.", url)
+            return None
+        entry_details = self.parse_entry_details(html, url)
+        metrics.observe(
+            "douban_parse_duration_seconds",
+            time.perf_counter() - parse_started_at,
+            category=self.category,
+            kind="subject",
+        )
+        return entry_details
+
+    def parse_entry_details(self, html, url):
+        return None
 
+
+class DoubanMovieCrawler(DoubanCrawler):
+    def parse_entry_details(self, html, url):
         episode = None
         external_id = ""
         found_info_span_list = html.xpath('//div[@id="info"]/span')
@@ -173,11 +284,7 @@ class DoubanMovieCrawler(DoubanCrawler):
         else:
             type = "Movie"
 
-        result = {
-            "type": type,
-            "genres": genres,
-            "external_id": external_id,
-        }
+        result = EntryDetails(type=type, genres=genres, external_id=external_id)
         logger.info(
             "Scraped: {}.",
             result,
@@ -186,15 +293,7 @@ class DoubanMovieCrawler(DoubanCrawler):
 
 
 class DoubanMusicCrawler(DoubanCrawler):
-    def get_entry_details(self, url):
-        res = self.request_get(url, headers=self.headers)
-        if res == None:
-            return None
-
-        text = res.text
-        soup = BeautifulSoup(text, "lxml")
-        html = etree.HTML(str(soup).strip())
-
+    def parse_entry_details(self, html, url):
         found_titles = html.xpath('//div[@id="wrapper"]/h1/span/text()')
         if len(found_titles) > 0:
             titles = found_titles
@@ -210,7 +309,7 @@ class DoubanMusicCrawler(DoubanCrawler):
         if len(found_info_span_list) > 0:
             for found_info_span in found_info_span_list:
                 if found_info_span.text == "又名:":
-                    aliases = found_info_span.tail.strip()
+                    aliases = split_titles(found_info_span.tail.strip())
                 elif found_info_span.text == "出版者:":
                     label = found_info_span.tail.strip()
                 elif found_info_span.text == "发行时间:":
@@ -226,15 +325,15 @@ class DoubanMusicCrawler(DoubanCrawler):
             for found_artist in found_artists_span_list:
                 artists.append(found_artist.text.strip())
 
-        result = {
-            "type": "Music",
-            "titles": titles,
-            "aliases": aliases,
-            "artists": artists,
-            "label": label,
-            "release_date": release_date,
-            "external_id": external_id,
-        }
+        result = EntryDetails(
+            type="Music",
+            titles=titles,
+            aliases=aliases,
+            artists=artists,
+            label=label,
+            release_date=release_date,
+            external_id=external_id,
+        )
         logger.info(
             "Scraped: {}",
             result,
@@ -0,0 +1,86 @@
+import datetime
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import fields
+
+# The entries of a run are kept in the jobs, the checkpoints and the list files until it ends.
+# Slotted records take a fraction of the memory of the dicts they replace, and the repeated strings are interned.
+
+
+@dataclass(slots=True)
+class UserEntry:
+    id: str
+    titles: list
+    url: str = ""
+    # The date the entry was marked, as a proleptic Gregorian ordinal
+    added_date: int = 0
+
+    @property
+    def added_date_str(self):
+        return datetime.date.fromordinal(self.added_date).isoformat()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "titles": self.titles,
+            "url": self.url,
+            "added_date": self.added_date_str,
+        }
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(
+            id=record["id"],
+            titles=record["titles"],
+            url=record.get("url", ""),
+            added_date=datetime.date.fromisoformat(record["added_date"]).toordinal(),
+        )
+
+
+@dataclass(slots=True)
+class EntryDetails:
+    id: str = None
+    # "Movie", "Series" or "Music"
+    type: str = None
+    titles: list = field(default_factory=list)
+    external_id: str = ""
+    # The fields below are only set for some entries, and left out of the JSON records when they aren't
+    url: str = None
+    genres: list = None
+    aliases: list = None
+    artists: list = None
+    label: str = None
+    release_date: str = None
+    # The id of the item in the Servarr library, when it's known from an earlier run or the item has just been added
+    servarr_id: int = None
+
+    def to_dict(self):
+        record = {}
+        for record_field in fields(self):
+            value = getattr(self, record_field.name)
+            if value is not None:
+                record[record_field.name] = value
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        entry_details = cls()
+        for record_field in fields(cls):
+            if record_field.name in record:
+                setattr(entry_details, record_field.name, record[record_field.name])
+        if entry_details.type is not None:
+            entry_details.type = sys.intern(entry_details.type)
+        if isinstance(entry_details.aliases, str):
+            # The records written before the aliases were split
+            entry_details.aliases = split_titles(entry_details.aliases)
+        return entry_details
+
+
+def to_json_value(record):
+    # The default of json.dumps, so the records could be written as they are
+    return record.to_dict()
+
+
+def split_titles(titles):
+    return [title for title in titles.split(" / ") if title != ""]
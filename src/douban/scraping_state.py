@@ -0,0 +1,131 @@
+import datetime
+import time
+
+from loguru import logger
+
+from douban.records import UserEntry
+from utils.file_utils import load_json
+from utils.file_utils import write_json_atomically
+
+
+class ScrapingState:
+    def __init__(
+        self,
+        file_path,
+        max_seen_ids=500,
+        max_attempts=10,
+        retry_backoff_base_secs=3600.0,
+        retry_backoff_max_secs=7 * 86400.0,
+    ):
+        self.file_path = file_path
+        self.max_seen_ids = max_seen_ids
+        # The failed entries are retried after a growing break, and given up on after this many attempts
+        self.max_attempts = max_attempts
+        self.retry_backoff_base_secs = retry_backoff_base_secs
+        self.retry_backoff_max_secs = retry_backoff_max_secs
+        self.records = load_json(self.file_path, {}, "the scraping state")
+        self.seen_id_sets = {}
+
+    def get_key(self, user, category, list_type):
+        return "%s/%s/%s" % (user, category, list_type)
+
+    def get_seen_ids(self, key):
+        if key not in self.seen_id_sets:
+            self.seen_id_sets[key] = set(self.records[key]["seen_ids"])
+        return self.seen_id_sets[key]
+
+    def is_scraped_before(self, user, category, list_type, added_date_str):
+        key = self.get_key(user, category, list_type)
+        if key not in self.records:
+            return False
+        # The dates are in the ISO format so they could be compared as strings.
+        # Every entry older than the watermark has been added or is retried by its id, so the scraping could stop there.
+        return added_date_str < self.records[key]["newest_added_date"]
+
+    def is_seen(self, user, category, list_type, id):
+        # The entries on the watermark's date are skipped one by one, so are the failed ones retried by their ids.
+        # A re-marked entry would move to the top of the list with a new date.
+        key = self.get_key(user, category, list_type)
+        if key not in self.records:
+            return False
+        return id in self.get_seen_ids(key) or id in self.records[key].get("failed", {})
+
+    def get_retry_entries(self, user, category, list_type, now=None):
+        # The failed entries due for another attempt, only their ids and dates are known
+        key = self.get_key(user, category, list_type)
+        if key not in self.records:
+            return []
+        if now is None:
+            now = time.time()
+        return [
+            UserEntry(
+                id=id,
+                titles=[],
+                added_date=datetime.date.fromisoformat(
+                    failure["added_date"]
+                ).toordinal(),
+            )
+            for id, failure in self.records[key].get("failed", {}).items()
+            if failure["retry_at"] <= now
+        ]
+
+    def get_retry_backoff_secs(self, attempts):
+        return min(
+            self.retry_backoff_max_secs,
+            self.retry_backoff_base_secs * 2 ** (attempts - 1),
+        )
+
+    def update(self, user, category, list_type, added_dates, completed_ids, now=None):
+        # added_dates are the ids -> ordinal dates of the entries of this run, completed_ids the ones detailed and added successfully
+        if len(added_dates) == 0:
+            return
+        if now is None:
+            now = time.time()
+        key = self.get_key(user, category, list_type)
+        record = self.records.get(key, {"newest_added_date": "", "seen_ids": []})
+
+        failed = dict(record.get("failed", {}))
+        for id, added_date in added_dates.items():
+            if id in completed_ids:
+                failed.pop(id, None)
+                continue
+            attempts = failed.get(id, {}).get("attempts", 0) + 1
+            if attempts > self.max_attempts:
+                logger.warning(
+                    "Giving up on entry {} of {} after {} attempts.",
+                    id,
+                    key,
+                    attempts - 1,
+                )
+                failed.pop(id, None)
+                continue
+            failed[id] = {
+                "added_date": datetime.date.fromordinal(added_date).isoformat(),
+                "attempts": attempts,
+                "retry_at": now + self.get_retry_backoff_secs(attempts),
+            }
+
+        # The watermark moves past the failed entries, they're kept above and retried by their ids
+        newest_added_date = max(
+            datetime.date.fromordinal(max(added_dates.values())).isoformat(),
+            record["newest_added_date"],
+        )
+        # Only the entries on the watermark's date are scraped again by the next run
+        seen_ids = [
+            id
+            for id, added_date in added_dates.items()
+            if id in completed_ids
+            and datetime.date.fromordinal(added_date).isoformat() == newest_added_date
+        ]
+        if newest_added_date == record["newest_added_date"]:
+            existing_ids = set(seen_ids)
+            seen_ids.extend(id for id in record["seen_ids"] if id not in existing_ids)
+        self.records[key] = {
+            "newest_added_date": newest_added_date,
+            "seen_ids": seen_ids[: self.max_seen_ids],
+            "failed": failed,
+        }
+        self.seen_id_sets.pop(key, None)
+
+    def save(self):
+        write_json_atomically(self.file_path, self.records, indent=4, sort_keys=True)
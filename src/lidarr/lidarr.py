@@ -1,9 +1,8 @@
 import json
 
 from loguru import logger
-from lxml import etree
-from lxml import html
 
+from lidarr.musicbrainz import MusicBrainz
 from servarr.servarr import Servarr
 
 
@@ -20,6 +19,11 @@ class Lidarr(Servarr):
         addOptions={},
         qualityProfileId=1,
         metadataProfileId=1,
+        cache_dir=None,
+        library_cache_max_age_secs=0,
+        musicbrainz_cache_ttl_days=90,
+        musicbrainz_cache_miss_ttl_hours=24,
+        musicbrainz_contact="",
     ):
         Servarr.__init__(
             self,
@@ -34,9 +38,20 @@ class Lidarr(Servarr):
             monitored,
             addOptions,
             qualityProfileId,
+            cache_dir,
+            library_cache_max_age_secs,
         )
 
         self.metadataProfileId = metadataProfileId
+        self.musicbrainz = MusicBrainz(
+            cache_dir,
+            musicbrainz_cache_ttl_days,
+            musicbrainz_cache_miss_ttl_hours,
+            musicbrainz_contact,
+        )
+
+    def get_item_external_ids(self, item):
+        return [item.get("foreignAlbumId")]
 
     def is_any_matching(self, external_id, searching_titles, item):
         title_lowercase = item["title"].lower()
@@ -45,47 +60,55 @@ class Lidarr(Servarr):
                 return True
         return False
 
-    def try_to_search_with_mb_url(self, url):
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
-        }
-        mb_res = self.request_wrapper.get(url, headers=headers)
-        mb_html = html.fromstring(bytes(mb_res.text, encoding="utf8"))
-        return mb_html.xpath("//release[1]/release-group[1]/@id")
+    def prefetch_release_groups(self, caller_object_details_list):
+        self.musicbrainz.prefetch_barcodes(
+            [
+                caller_object_details.external_id
+                for caller_object_details in caller_object_details_list
+            ]
+        )
 
     def try_to_search_with_all_possible_terms(self, caller_object_details):
-        external_id = caller_object_details["external_id"]
-        found_release_group_urls = []
-        if external_id is not None:
-            mb_url = (
-                "https://musicbrainz.org/ws/2/release/?query=barcode:%s" % external_id
+        external_id = caller_object_details.external_id
+        if external_id is not None and external_id != "":
+            release_group_id = self.musicbrainz.find_release_group_id_by_barcode(
+                external_id
             )
-            found_release_group_urls = self.try_to_search_with_mb_url(mb_url)
-            if len(found_release_group_urls) > 0:
-                return found_release_group_urls
+            if release_group_id is not None:
+                return release_group_id
 
-        titles = caller_object_details["titles"]
+        titles = caller_object_details.titles
         for title in titles:
-            mb_url = "https://musicbrainz.org/ws/2/release/?query=release:%s" % title
-            found_release_group_urls = self.try_to_search_with_mb_url(mb_url)
-            if len(found_release_group_urls) > 0:
-                return found_release_group_urls
+            release_group_id = self.musicbrainz.find_release_group_id_by_title(title)
+            if release_group_id is not None:
+                return release_group_id
 
-        return found_release_group_urls
+        return None
 
-    def search_and_add(self, caller_object_details, list_type):
-        external_id = caller_object_details["external_id"]
-        found_release_group_urls = self.try_to_search_with_all_possible_terms(
-            caller_object_details
-        )
+    def resolve_external_ids(self, caller_object_details):
+        return {
+            "release_group_id": self.try_to_search_with_all_possible_terms(
+                caller_object_details
+            )
+        }
 
-        mb_id = ""
-        if len(found_release_group_urls) > 0:
-            mb_id = str(found_release_group_urls[0])
+    def search_and_add(self, caller_object_details, list_type, resolved_ids=None):
+        external_id = caller_object_details.external_id
+        if resolved_ids is None:
+            resolved_ids = self.resolve_external_ids(caller_object_details)
+        mb_id = resolved_ids["release_group_id"]
+        if mb_id is None:
+            mb_id = ""
 
-        titles = caller_object_details["titles"]
+        titles = caller_object_details.titles
         if len(mb_id) > 0:
             mb_id = mb_id.strip()
+            # The album could have been added under another title
+            added_item = self.find_added_item_by_external_id(mb_id)
+            if added_item is not None:
+                # Found by its ids, so the subject is mapped to it like the added items
+                caller_object_details.servarr_id = added_item.get("id")
+                return self.update_added_item(added_item, titles, list_type)
             if self.try_to_add_by_term(
                 "lidarr:" + mb_id, caller_object_details, list_type
             ):
@@ -0,0 +1,154 @@
+import json
+import os
+
+from loguru import logger
+
+from utils.persistent_cache import PersistentCache
+from utils.request_utils import RequestUtils
+
+
+class MusicBrainz:
+    def __init__(
+        self,
+        cache_dir=None,
+        cache_ttl_days=90,
+        cache_miss_ttl_hours=24,
+        contact="",
+        max_barcodes_per_query=20,
+    ):
+        self.url = "https://musicbrainz.org/ws/2/release/"
+        # See https://musicbrainz.org/doc/MusicBrainz_API/Rate_Limiting, the anonymous clients are limited to 1 request per second
+        self.request_wrapper = RequestUtils(
+            request_interval_mode=True,
+            max_attempt=3,
+            request_rate=1.0,
+            request_burst=1,
+        )
+        user_agent = "douban-to-servarr/1.0"
+        if contact != "":
+            user_agent += " ( %s )" % contact
+        self.headers = {"User-Agent": user_agent, "Accept": "application/json"}
+        self.max_barcodes_per_query = max_barcodes_per_query
+
+        # Search term -> release group ID, the terms not found are saved separately and retried once they expire
+        self.release_group_cache = None
+        self.release_group_miss_cache = None
+        if cache_dir is not None:
+            cache_file_path = os.path.join(cache_dir, "musicbrainz.sqlite")
+            self.release_group_cache = PersistentCache(
+                cache_file_path,
+                table="release_groups",
+                ttl_secs=cache_ttl_days * 24 * 3600,
+            )
+            self.release_group_miss_cache = PersistentCache(
+                cache_file_path,
+                table="release_group_misses",
+                ttl_secs=cache_miss_ttl_hours * 3600,
+            )
+
+    def get_cached_release_group_id(self, term):
+        # Returns the ID, "" if the term is known to be not found, or None if it's not cached
+        if self.release_group_cache is None:
+            return None
+        release_group_id = self.release_group_cache.get(term)
+        if release_group_id is not None:
+            return release_group_id
+        if self.release_group_miss_cache.get(term) is not None:
+            return ""
+        return None
+
+    def cache_release_group_id(self, term, release_group_id):
+        if self.release_group_cache is None:
+            return
+        if release_group_id is not None:
+            self.release_group_cache.set(term, release_group_id)
+        else:
+            self.release_group_miss_cache.set(term, True)
+
+    def search_releases(self, query, limit=1):
+        r = self.request_wrapper.get(
+            self.url,
+            params={"query": query, "limit": limit, "fmt": "json"},
+            headers=self.headers,
+        )
+        if r is None or r.status_code != 200:
+            logger.warning(
+                "Unable to search MusicBrainz with {}: {}.",
+                query,
+                "no response" if r is None else r.status_code,
+            )
+            return None
+        return json.loads(r.content)
+
+    def find_release_group_id(self, term, query):
+        cached_release_group_id = self.get_cached_release_group_id(term)
+        if cached_release_group_id is not None:
+            return cached_release_group_id if cached_release_group_id != "" else None
+
+        result = self.search_releases(query)
+        if result is None:
+            return None
+        release_group_id = None
+        for release in result.get("releases", []):
+            if "release-group" in release:
+                release_group_id = release["release-group"]["id"]
+                break
+        self.cache_release_group_id(term, release_group_id)
+        return release_group_id
+
+    def find_release_group_id_by_barcode(self, barcode):
+        return self.find_release_group_id(
+            "barcode:%s" % barcode, "barcode:%s" % barcode
+        )
+
+    def find_release_group_id_by_title(self, title):
+        return self.find_release_group_id("release:%s" % title, "release:%s" % title)
+
+    def prefetch_barcodes(self, barcodes):
+        # Several barcodes are looked up with one OR-query, the later lookups are answered by the cache
+        if self.release_group_cache is None:
+            return
+        uncached_barcodes = []
+        for barcode in barcodes:
+            if (
+                barcode is None
+                or barcode == ""
+                or not barcode.isdigit()
+                or barcode in uncached_barcodes
+            ):
+                continue
+            if self.get_cached_release_group_id("barcode:%s" % barcode) is None:
+                uncached_barcodes.append(barcode)
+        if len(uncached_barcodes) == 0:
+            return
+        logger.info(
+            "Looking up {} barcode(s) on MusicBrainz in batches.",
+            len(uncached_barcodes),
+        )
+
+        for i in range(0, len(uncached_barcodes), self.max_barcodes_per_query):
+            batch = uncached_barcodes[i : i + self.max_barcodes_per_query]
+            result = self.search_releases(
+                " OR ".join(["barcode:%s" % barcode for barcode in batch]), limit=100
+            )
+            if result is None:
+                continue
+            releases = result.get("releases", [])
+            found_release_group_ids = {}
+            for release in releases:
+                barcode = release.get("barcode")
+                if (
+                    barcode in batch
+                    and barcode not in found_release_group_ids
+                    and "release-group" in release
+                ):
+                    found_release_group_ids[barcode] = release["release-group"]["id"]
+            # Some releases might be cut off by the limit, only the complete results tell what's not on MusicBrainz
+            is_complete = result.get("count", 0) <= len(releases)
+            for barcode in batch:
+                if barcode in found_release_group_ids:
+                    self.cache_release_group_id(
+                        "barcode:%s" % barcode, found_release_group_ids[barcode]
+                    )
+                elif is_complete:
+                    self.cache_release_group_id("barcode:%s" % barcode, None)
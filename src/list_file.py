@@ -0,0 +1,71 @@
+import json
+import sys
+
+from loguru import logger
+
+from douban.records import to_json_value
+from utils.file_utils import make_parent_dirs
+
+
+class ListFileWriter:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = None
+        self.count = 0
+
+    def write(self, list_type, entry):
+        # The file is only created with the first entry, so empty lists leave nothing behind
+        if self.file is None:
+            make_parent_dirs(self.file_path)
+            logger.info("Saving the list to {}.", self.file_path)
+            self.file = open(self.file_path, "w", encoding="utf-8")
+        record = {"list_type": list_type, "entry": entry}
+        self.file.write(
+            json.dumps(
+                record, ensure_ascii=False, sort_keys=True, default=to_json_value
+            )
+            + "\n"
+        )
+        # Everything written so far survives a crash
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_list_file(list_file_path, record_type):
+    # record_type is UserEntry or EntryDetails, depending on the kind of the list file
+    for list_type, entry in read_list_file_records(list_file_path):
+        yield sys.intern(list_type), record_type.from_dict(entry)
+
+
+def read_list_file_records(list_file_path):
+    if list_file_path.endswith(".list"):
+        # The previous format, a single JSON document of {list_type: [entries]}
+        with open(list_file_path, "r", encoding="utf-8") as file:
+            loaded_list = json.load(file)
+        for list_type, entries in loaded_list.items():
+            for entry in entries:
+                yield list_type, entry
+        return
+
+    # One JSON record per line, read one at a time
+    with open(list_file_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line could have been cut off by a crash
+                logger.warning(
+                    "Skipping the broken line {} of the list file '{}'.",
+                    line_number,
+                    list_file_path,
+                )
+                continue
+            yield record["list_type"], record["entry"]
@@ -1,251 +1,873 @@
 import os
+import dataclasses
 import datetime
-import json
+import threading
 from loguru import logger
 from douban.douban import DoubanMovieCrawler
 from douban.douban import DoubanMusicCrawler
+from douban.records import EntryDetails
+from douban.records import UserEntry
+from douban.scraping_state import ScrapingState
+from checkpoint import Checkpoint
 from radarr.radarr import Radarr
 from sonarr.sonarr import Sonarr
 from lidarr.lidarr import Lidarr
+from list_file import ListFileWriter
+from list_file import read_list_file
+from pipeline import Pipeline
+from subject_mappings import SubjectMappings
+from subject_registry import SubjectRegistry
+from utils.metrics import metrics
+from utils.metrics import write_run_report
+from utils.persistent_cache import PersistentCache
 
 
 class ListParser:
     def __init__(self, **kwargs):
         self.workdir = kwargs["workdir"]
         self.douban_config = kwargs["douban"]
-        self.movie_crawler = DoubanMovieCrawler("movie", self.douban_config["cookies"])
-        self.music_crawler = DoubanMusicCrawler("music", self.douban_config["cookies"])
-        self.radarr = Radarr(
-            host=kwargs["radarr"]["host"],
-            port=kwargs["radarr"]["port"],
-            url_base=kwargs["radarr"]["url_base"],
-            api_key=kwargs["radarr"]["api_key"],
-            is_https=kwargs["radarr"]["https"],
-            rootFolderPath=kwargs["radarr"]["rootFolderPath"],
-            monitored=kwargs["radarr"]["monitored"],
-            addOptions=kwargs["radarr"]["addOptions"],
-            qualityProfileId=kwargs["radarr"]["qualityProfileId"],
-            minimumAvailability=kwargs["radarr"]["minimumAvailability"],
-        )
-        self.sonarr = Sonarr(
-            host=kwargs["sonarr"]["host"],
-            port=kwargs["sonarr"]["port"],
-            url_base=kwargs["sonarr"]["url_base"],
-            api_key=kwargs["sonarr"]["api_key"],
-            is_https=kwargs["sonarr"]["https"],
-            rootFolderPath=kwargs["sonarr"]["rootFolderPath"],
-            monitored=kwargs["sonarr"]["monitored"],
-            addOptions=kwargs["sonarr"]["addOptions"],
-            qualityProfileId=kwargs["sonarr"]["qualityProfileId"],
-            languageProfileId=kwargs["sonarr"]["languageProfileId"],
-            seriesType=kwargs["sonarr"]["seriesType"],
-            addSeasonSubfolder=kwargs["sonarr"]["addSeasonSubfolder"],
-            genreSubfolderPath=kwargs["sonarr"]["genreSubfolderPath"],
-        )
-        self.lidarr = Lidarr(
-            host=kwargs["lidarr"]["host"],
-            port=kwargs["lidarr"]["port"],
-            url_base=kwargs["lidarr"]["url_base"],
-            api_key=kwargs["lidarr"]["api_key"],
-            is_https=kwargs["lidarr"]["https"],
-            rootFolderPath=kwargs["lidarr"]["rootFolderPath"],
-            monitored=kwargs["lidarr"]["monitored"],
-            addOptions=kwargs["lidarr"]["addOptions"],
-            qualityProfileId=kwargs["lidarr"]["qualityProfileId"],
-            metadataProfileId=kwargs["lidarr"]["metadataProfileId"],
+        self.details_cache = None
+        if self.douban_config["details_cache_enabled"]:
+            self.details_cache = PersistentCache(
+                os.path.join(self.workdir, "cache", "douban_details.sqlite"),
+                table="subject_details",
+                ttl_secs=self.douban_config["details_cache_ttl_days"] * 24 * 3600,
+                max_entries=self.douban_config["details_cache_max_entries"],
+            )
+        self.scraping_state = None
+        if self.douban_config["incremental"]:
+            self.scraping_state = ScrapingState(
+                os.path.join(self.workdir, "state", "scraping_state.json")
+            )
+        self.scraping_state_lock = threading.Lock()
+        self.subject_mappings = None
+        if self.douban_config["subject_mappings_enabled"]:
+            self.subject_mappings = SubjectMappings(
+                os.path.join(self.workdir, "state", "subject_mappings.json")
+            )
+        # Each Servarr client keeps its own states, so only one add could happen on it at a time
+        self.add_locks = {
+            "Series": threading.Lock(),
+            "Movie": threading.Lock(),
+            "Music": threading.Lock(),
+        }
+        self.radarr_config = kwargs["radarr"]
+        self.sonarr_config = kwargs["sonarr"]
+        self.lidarr_config = kwargs["lidarr"]
+        # The crawlers and the Servarr clients are created on first use, so the unused ones don't cost any requests
+        self.clients = {}
+        self.client_locks = {
+            name: threading.Lock()
+            for name in ["movie_crawler", "music_crawler", "radarr", "sonarr", "lidarr"]
+        }
+
+    def get_client(self, name):
+        with self.client_locks[name]:
+            if name not in self.clients:
+                self.clients[name] = getattr(self, "create_" + name)()
+            return self.clients[name]
+
+    def get_created_servarrs(self):
+        return [
+            self.clients[name]
+            for name in ["radarr", "sonarr", "lidarr"]
+            if name in self.clients
+        ]
+
+    @property
+    def movie_crawler(self):
+        return self.get_client("movie_crawler")
+
+    @property
+    def music_crawler(self):
+        return self.get_client("music_crawler")
+
+    @property
+    def radarr(self):
+        return self.get_client("radarr")
+
+    @property
+    def sonarr(self):
+        return self.get_client("sonarr")
+
+    @property
+    def lidarr(self):
+        return self.get_client("lidarr")
+
+    def create_movie_crawler(self):
+        return DoubanMovieCrawler(
+            "movie",
+            self.douban_config["cookies"],
+            self.details_cache,
+            request_rate=self.douban_config["request_rate"],
+            request_burst=self.douban_config["request_burst"],
+            request_jitter_secs=self.douban_config["request_jitter_secs"],
+            base_url=self.douban_config["base_url"],
+        )
+
+    def create_music_crawler(self):
+        return DoubanMusicCrawler(
+            "music",
+            self.douban_config["cookies"],
+            self.details_cache,
+            request_rate=self.douban_config["request_rate"],
+            request_burst=self.douban_config["request_burst"],
+            request_jitter_secs=self.douban_config["request_jitter_secs"],
+            base_url=self.douban_config["base_url"],
+        )
+
+    def create_radarr(self):
+        return Radarr(
+            host=self.radarr_config["host"],
+            port=self.radarr_config["port"],
+            url_base=self.radarr_config["url_base"],
+            api_key=self.radarr_config["api_key"],
+            is_https=self.radarr_config["https"],
+            cache_dir=os.path.join(self.workdir, "cache"),
+            library_cache_max_age_secs=self.radarr_config[
+                "library_cache_max_age_minutes"
+            ]
+            * 60,
+            rootFolderPath=self.radarr_config["rootFolderPath"],
+            monitored=self.radarr_config["monitored"],
+            addOptions=self.radarr_config["addOptions"],
+            qualityProfileId=self.radarr_config["qualityProfileId"],
+            minimumAvailability=self.radarr_config["minimumAvailability"],
+        )
+
+    def create_sonarr(self):
+        return Sonarr(
+            host=self.sonarr_config["host"],
+            port=self.sonarr_config["port"],
+            url_base=self.sonarr_config["url_base"],
+            api_key=self.sonarr_config["api_key"],
+            is_https=self.sonarr_config["https"],
+            cache_dir=os.path.join(self.workdir, "cache"),
+            library_cache_max_age_secs=self.sonarr_config[
+                "library_cache_max_age_minutes"
+            ]
+            * 60,
+            external_id_cache_ttl_days=self.sonarr_config["external_id_cache_ttl_days"],
+            external_id_cache_miss_ttl_hours=self.sonarr_config[
+                "external_id_cache_miss_ttl_hours"
+            ],
+            rootFolderPath=self.sonarr_config["rootFolderPath"],
+            monitored=self.sonarr_config["monitored"],
+            addOptions=self.sonarr_config["addOptions"],
+            qualityProfileId=self.sonarr_config["qualityProfileId"],
+            languageProfileId=self.sonarr_config["languageProfileId"],
+            seriesType=self.sonarr_config["seriesType"],
+            addSeasonSubfolder=self.sonarr_config["addSeasonSubfolder"],
+            genreSubfolderPath=self.sonarr_config["genreSubfolderPath"],
+        )
+
+    def create_lidarr(self):
+        return Lidarr(
+            host=self.lidarr_config["host"],
+            port=self.lidarr_config["port"],
+            url_base=self.lidarr_config["url_base"],
+            api_key=self.lidarr_config["api_key"],
+            is_https=self.lidarr_config["https"],
+            cache_dir=os.path.join(self.workdir, "cache"),
+            library_cache_max_age_secs=self.lidarr_config[
+                "library_cache_max_age_minutes"
+            ]
+            * 60,
+            musicbrainz_cache_ttl_days=self.lidarr_config["musicbrainz_cache_ttl_days"],
+            musicbrainz_cache_miss_ttl_hours=self.lidarr_config[
+                "musicbrainz_cache_miss_ttl_hours"
+            ],
+            musicbrainz_contact=self.lidarr_config["musicbrainz_contact"],
+            rootFolderPath=self.lidarr_config["rootFolderPath"],
+            monitored=self.lidarr_config["monitored"],
+            addOptions=self.lidarr_config["addOptions"],
+            qualityProfileId=self.lidarr_config["qualityProfileId"],
+            metadataProfileId=self.lidarr_config["metadataProfileId"],
         )
 
     def start(self):
+        started_at = datetime.datetime.now()
+        metrics_snapshot = metrics.get_snapshot()
         logger.info(
             "Starting at {}.",
-            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            started_at.strftime("%Y-%m-%d %H:%M:%S"),
         )
+        # The clients kept from the earlier runs only fetch what has changed in the libraries since then
+        for servarr in self.get_created_servarrs():
+            servarr.refresh_library()
+
+        # The subjects in several users' lists are fetched and added once per run
+        self.subject_registry = SubjectRegistry()
+        # scraper -> detail fetcher -> matcher -> Servarr writer, so the users and categories are processed at the same time
+        queue_size = self.douban_config["pipeline_queue_size"]
+        categories = [
+            category for category in self.douban_config["categories"] if category != ""
+        ]
+        pipeline = Pipeline()
+        # Every category is on its own Douban host with its own rate limit, so each gets its own scrapers and detail fetchers.
+        # A host waiting for its rate limit doesn't hold the others back, and the run takes about as long as the slowest host.
+        self.scraper_stages = {}
+        for category in categories:
+            self.scraper_stages[category] = pipeline.add_stage(
+                "%s_scraper" % category,
+                self.process_user_lists,
+                self.douban_config["scrape_workers"],
+                queue_size,
+            )
+        self.detail_stages = {}
+        for category in categories:
+            self.detail_stages[category] = pipeline.add_stage(
+                "%s_detail_fetcher" % category,
+                self.process_user_entry,
+                self.douban_config["detail_workers"],
+                queue_size,
+            )
+        self.matcher_stage = pipeline.add_stage(
+            "matcher",
+            self.match_entry,
+            self.douban_config["match_workers"],
+            queue_size,
+        )
+        self.writer_stage = pipeline.add_stage(
+            "servarr_writer",
+            self.write_entry,
+            self.douban_config["add_workers"],
+            queue_size,
+        )
+        pipeline.start()
+
         users = self.douban_config["user_domain"]
-        categories = self.douban_config["categories"]
         for u in users:
             if u == "":
                 continue
             for category in categories:
-                if category == "":
-                    continue
-                self.process_user_lists(
-                    u,
-                    category,
-                    list_types=self.douban_config["list_types"],
-                    start_date=self.douban_config["start_date"],
-                    end_date=self.douban_config["end_date"],
-                    start_page=self.douban_config["start_page"],
-                    mode=self.douban_config["mode"],
-                    instant_add=self.douban_config["instant_add"],
-                    list_file_path=self.douban_config["list_file_path"],
+                self.scraper_stages[category].put(
+                    UserListsJob(
+                        u,
+                        category,
+                        list_types=self.douban_config["list_types"],
+                        start_date=self.douban_config["start_date"],
+                        end_date=self.douban_config["end_date"],
+                        start_page=self.douban_config["start_page"],
+                        mode=self.douban_config["mode"],
+                        instant_add=self.douban_config["instant_add"],
+                        list_file_path=self.douban_config["list_file_path"],
+                    )
                 )
+        pipeline.join()
+        self.flush_tag_updates()
+        self.save_snapshots()
+        if self.subject_mappings is not None:
+            self.subject_mappings.save()
+        self.write_run_report(started_at, metrics_snapshot)
         logger.info("The scraper finished all tasks.")
 
-    def process_user_lists(
-        self,
-        user_id,
-        category,
-        list_types,
-        start_date,
-        end_date,
-        start_page,
-        mode="scrape_and_add",
-        instant_add=True,
-        list_file_path="",
-    ):
-        entry_details_lists = self.get_entry_details_lists(
-            user_id,
-            category,
-            list_types,
-            start_date,
-            end_date,
-            start_page,
-            mode,
-            instant_add,
-            list_file_path,
+    def write_run_report(self, started_at, metrics_snapshot):
+        finished_at = datetime.datetime.now()
+        report = {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "finished_at": finished_at.isoformat(timespec="seconds"),
+            "duration_secs": round((finished_at - started_at).total_seconds(), 3),
+        }
+        report.update(metrics.get_report(since=metrics_snapshot))
+        write_run_report(
+            os.path.join(
+                self.workdir,
+                "reports",
+                started_at.strftime("%Y%m%d_%H%M%S") + "_run_report.json",
+            ),
+            report,
         )
 
-        if (
-            entry_details_lists is not None
-            and instant_add == False
-            and mode != "scrape_only"
-        ):
-            for list_type in list_types:
-                for entry_details in entry_details_lists[list_type]:
-                    self.add_entry(entry_details, list_type)
-
-    def get_entry_details_lists(
-        self,
-        user_id,
-        category,
-        list_types,
-        start_date,
-        end_date,
-        start_page,
-        mode,
-        instant_add,
-        list_file_path,
-    ):
-        user_entries_lists = {}
-        entry_details_lists = {}
+    def process_user_lists(self, job):
+        # The progress is journaled so an interrupted run could pick up where it stopped
+        if job.mode != "add_from_file":
+            job.checkpoint = Checkpoint(
+                os.path.join(
+                    self.workdir,
+                    "checkpoints",
+                    "%s_%s.journal" % (job.user_id, job.category),
+                )
+            )
+        try:
+            self.scrape_user_entries(job)
+        except Exception:
+            # The half-scraped lists are left to the checkpoint, and kept out of the scraping state
+            job.unfinished_list_types.update(job.list_types)
+            raise
+        finally:
+            if job.finish_scraping():
+                self.finish_entry_details(job)
 
-        if mode == "add_from_file":
-            if category not in list_file_path:
+    def scrape_user_entries(self, job):
+        if job.mode == "add_from_file":
+            if job.category not in job.list_file_path:
                 logger.info(
                     "The user entries list {} is not for category {}, skipping to the next category.",
-                    list_file_path,
-                    category,
+                    job.list_file_path,
+                    job.category,
+                )
+                return
+            if "entry_details" in job.list_file_path:
+                job.entry_details_file_path = job.list_file_path
+                return
+            if "user_entries" not in job.list_file_path:
+                logger.error(
+                    "Trying to load an unsupported list file '{}'.",
+                    job.list_file_path,
+                )
+                return
+
+            job.entry_details_writer = self.create_list_file_writer(
+                "entry_details", job.category, job.user_id
+            )
+            # The entries are handed over while the file is being read
+            entry_count = 0
+            for list_type, user_entry in read_list_file(job.list_file_path, UserEntry):
+                entry_count += 1
+                if list_type not in job.list_types:
+                    continue
+                job.record_entry(list_type, user_entry)
+                self.submit_user_entry(job, list_type, user_entry)
+            if entry_count == 0:
+                logger.warning(
+                    "The loaded list file {} is empty for user {}.",
+                    job.list_file_path,
+                    job.user_id,
                 )
-                return None
-            user_entries_lists, entry_details_lists = self.load_lists(list_file_path)
-            if len(entry_details_lists) > 0:
-                return entry_details_lists
+                return
+            logger.info(
+                "The user entries list {} of user {} has been load.",
+                job.list_file_path,
+                job.user_id,
+            )
+            return
 
-            if len(user_entries_lists) > 0:
+        if job.checkpoint.is_resumed:
+            logger.info(
+                "Resuming the interrupted run of category '{}' for user {}, recorded in '{}'.",
+                job.category,
+                job.user_id,
+                job.checkpoint.file_path,
+            )
+        crawler = self.get_crawler(job.category)
+        job.entry_details_writer = self.create_list_file_writer(
+            "entry_details", job.category, job.user_id
+        )
+        user_entries_writer = self.create_list_file_writer(
+            "user_entries", job.category, job.user_id
+        )
+        for list_type in job.list_types:
+            checkpoint_list = job.checkpoint.get_list(list_type)
+            for user_entry in job.checkpoint.take_entries(list_type):
+                job.record_entry(list_type, user_entry)
+                user_entries_writer.write(list_type, user_entry)
+                self.submit_user_entry(job, list_type, user_entry)
+            if checkpoint_list["scraped"]:
                 logger.info(
-                    "The user entries list {} of user {} has been load.",
-                    list_file_path,
-                    user_id,
+                    'List "{}" of {} has been scraped by the interrupted run.',
+                    list_type,
+                    job.user_id,
                 )
-            else:
+                continue
+
+            page_entries = []
+
+            def record_page(next_uri):
+                job.checkpoint.record_page(list_type, next_uri, page_entries)
+                page_entries.clear()
+
+            # The entries are handed to the detail fetchers while the next pages are being scraped
+            for user_entry in crawler.iterate_user_entries(
+                job.user_id,
+                list_type,
+                start_date=job.start_date,
+                end_date=job.end_date,
+                start_page=job.start_page,
+                scraping_state=self.scraping_state,
+                start_uri=checkpoint_list["uri"],
+                page_callback=record_page,
+            ):
+                job.record_entry(list_type, user_entry)
+                page_entries.append(user_entry)
+                user_entries_writer.write(list_type, user_entry)
+                self.submit_user_entry(job, list_type, user_entry)
+            # The last page marks the list as scraped, otherwise the crawler gave up on a page
+            if not checkpoint_list["scraped"]:
                 logger.warning(
-                    "The loaded list file {} is empty for user {}.",
-                    list_file_path,
-                    user_id,
+                    'List "{}" of {} is incomplete, the next run resumes it.',
+                    list_type,
+                    job.user_id,
                 )
-                return None
+                job.unfinished_list_types.add(list_type)
+            if self.scraping_state is not None and job.mode == "scrape_and_add":
+                # The entries that failed in the earlier runs are retried by their ids, without turning the pages back to them
+                for user_entry in self.scraping_state.get_retry_entries(
+                    job.user_id, job.category, list_type
+                ):
+                    logger.info(
+                        'Retrying entry {} of list "{}" of {}.',
+                        user_entry.id,
+                        list_type,
+                        job.user_id,
+                    )
+                    job.record_entry(list_type, user_entry)
+                    self.submit_user_entry(job, list_type, user_entry)
+        user_entries_writer.close()
+        if user_entries_writer.count == 0:
+            logger.info(
+                "There is nothing to add from the list(s) {} of category '{}' for user {}.",
+                job.list_types,
+                job.category,
+                job.user_id,
+            )
 
-        crawler = None
+    def get_crawler(self, category):
         if category == "movie":
-            crawler = self.movie_crawler
+            return self.movie_crawler
         elif category == "music":
-            crawler = self.music_crawler
-
-        if len(user_entries_lists) == 0:
-            user_entries_lists = crawler.get_user_entry_lists(
-                user_id,
-                list_types=list_types,
-                start_date=start_date,
-                end_date=end_date,
-                start_page=start_page,
-            )
-            if user_entries_lists is None or len(user_entries_lists) == 0:
-                logger.info(
-                    "There is nothing to add from the list(s) {} of category '{}' for user {}.",
-                    list_types,
-                    category,
-                    user_id,
+            return self.music_crawler
+        return None
+
+    def submit_user_entry(self, job, list_type, user_entry):
+        job.start_entry_details()
+        self.detail_stages[job.category].put((job, list_type, user_entry))
+
+    def process_user_entry(self, item):
+        job, list_type, user_entry = item
+        try:
+            # The matched entries only carry what the list page and the library tell,
+            # so they're left out of the entry details file and added right away
+            entry_details = self.match_user_entry(job, user_entry)
+            is_matched = entry_details is not None
+            if not is_matched:
+                entry_details = self.get_entry_details(job, list_type, user_entry)
+            if entry_details is None:
+                logger.warning(
+                    'Failed to scrape: "{}" (id: {}).',
+                    user_entry.titles,
+                    user_entry.id,
                 )
-                return None
-            else:
-                self.save_lists("user_entries", category, user_entries_lists)
+                return
+            if not is_matched:
+                job.write_entry_details(list_type, entry_details)
+            if job.is_added(list_type, entry_details.id):
+                job.complete_entry(list_type, entry_details.id)
+            elif is_matched or (job.instant_add and job.mode != "scrape_only"):
+                self.submit_add(job, list_type, entry_details)
+        finally:
+            if job.finish_entry_details():
+                self.finish_entry_details(job)
+
+    def match_user_entry(self, job, user_entry):
+        if job.mode == "scrape_only":
+            return None
+        mapped_entry_details = self.get_mapped_entry_details(job, user_entry)
+        if mapped_entry_details is not None:
+            return mapped_entry_details
+        # The titles on the list pages are enough to find the entries already in the libraries, only the others need their subject pages
+        if not self.douban_config["match_list_entries"]:
+            return None
+        # A movie entry found in Radarr's library could still be a series on Douban, only the subject page tells.
+        # So only the categories of a single type are matched by their titles.
+        types = self.get_category_types(job.category)
+        if len(types) != 1:
+            return None
+        servarr = self.get_servarr(types[0])
+        if (
+            servarr is None
+            or servarr.find_added_item(EntryDetails(titles=user_entry.titles)) is None
+        ):
+            return None
+        metrics.increase("douban_list_entries_matched_total", category=job.category)
+        return EntryDetails(
+            id=user_entry.id,
+            type=types[0],
+            titles=user_entry.titles,
+            url=user_entry.url,
+        )
+
+    def get_mapped_entry_details(self, job, user_entry):
+        if self.subject_mappings is None:
+            return None
+        mapping = self.subject_mappings.get(job.category, user_entry.id)
+        if mapping is None:
+            return None
+        # The item could have been deleted from the library since, and its id given to a new item
+        servarr = self.get_servarr(mapping["type"])
+        if servarr is None:
+            return None
+        added_item = servarr.find_added_item_by_id(mapping["servarr_id"])
+        if added_item is None:
+            return None
+        if len(mapping["external_ids"]) > 0 and set(mapping["external_ids"]).isdisjoint(
+            servarr.get_known_external_ids(added_item)
+        ):
+            return None
+        metrics.increase("subject_mapping_hits_total", category=job.category)
+        return EntryDetails(
+            id=user_entry.id,
+            type=mapping["type"],
+            titles=user_entry.titles,
+            url=user_entry.url,
+            servarr_id=mapping["servarr_id"],
+        )
+
+    def record_subject_mapping(self, category, entry_details):
+        servarr = self.get_servarr(entry_details.type)
+        if self.subject_mappings is None or servarr is None:
+            return
+        # Only the items added for the subject or found by its ids, a matching title could be another item
+        added_item = servarr.find_identified_item(entry_details)
+        if added_item is None or "id" not in added_item:
+            return
+        self.subject_mappings.set(
+            category,
+            entry_details.id,
+            {
+                "type": entry_details.type,
+                "servarr_id": added_item["id"],
+                "external_ids": servarr.get_known_external_ids(added_item),
+            },
+        )
+
+    def get_category_types(self, category):
+        if category == "movie":
+            return ["Movie", "Series"]
+        elif category == "music":
+            return ["Music"]
+        return []
 
-        for list_type in list_types:
-            entry_details_lists[list_type] = []
-            if list_type not in user_entries_lists:
-                logger.info("List type {} doesn't exist, skip to the next.", list_type)
+    def get_entry_details(self, job, list_type, user_entry):
+        # The entries detailed by an interrupted run don't need to be fetched again
+        if job.checkpoint is not None:
+            known_details = job.checkpoint.get_details(list_type, user_entry.id)
+            if known_details is not None:
+                return known_details
+
+        future, is_fetching = self.subject_registry.claim_details(
+            job.category, user_entry.id
+        )
+        if is_fetching:
+            try:
+                future.set_result(self.fetch_entry_details(job.category, user_entry.id))
+            except Exception as e:
+                future.set_exception(e)
+            if self.details_cache is not None and future.exception() is None:
+                # The later jobs find the details in the cache, they don't need to stay in memory
+                self.subject_registry.release_details(job.category, user_entry.id)
+        else:
+            # Another user's job is fetching or has fetched the same subject
+            metrics.increase("deduplicated_entries_total", stage="details")
+        entry_details = future.result()
+        if entry_details is None:
+            return None
+
+        # Every job gets its own copy to fill in with its list's titles
+        entry_details = dataclasses.replace(
+            entry_details, id=user_entry.id, titles=user_entry.titles
+        )
+        if job.checkpoint is not None:
+            job.checkpoint.record_details(list_type, user_entry.id, entry_details)
+        return entry_details
+
+    def fetch_entry_details(self, category, id):
+        return self.get_crawler(category).get_details_by_id(id)
+
+    def finish_entry_details(self, job):
+        # All the entries of the job have been detailed, or failed to
+        if job.entry_details_writer is not None:
+            job.entry_details_writer.close()
+            if job.entry_details_writer.count > 0:
+                job.entry_details_file_path = job.entry_details_writer.file_path
+
+        try:
+            if (
+                job.entry_details_file_path is not None
+                and job.instant_add == False
+                and job.mode != "scrape_only"
+            ):
+                self.submit_deferred_adds(job)
+        finally:
+            if job.finish_detailing():
+                self.complete_job(job)
+
+    def submit_deferred_adds(self, job):
+        if job.category == "music":
+            # The barcodes are looked up together before the albums are added one by one
+            self.lidarr.prefetch_release_groups(
+                [
+                    entry_details
+                    for list_type, entry_details in read_list_file(
+                        job.entry_details_file_path, EntryDetails
+                    )
+                    if list_type in job.list_types
+                ]
+            )
+        for list_type, entry_details in read_list_file(
+            job.entry_details_file_path, EntryDetails
+        ):
+            if list_type not in job.list_types:
+                continue
+            if job.is_added(list_type, entry_details.id):
+                job.complete_entry(list_type, entry_details.id)
                 continue
-            logger.info('Processing list: "{}"...', list_type)
-            for user_entry in user_entries_lists[list_type]:
-                entry_details = crawler.get_details_by_id(user_entry["id"])
-                if entry_details is None:
-                    logger.warning(
-                        'Failed to scrape: "{}" (id: {}).',
-                        user_entry["titles"],
-                        user_entry["id"],
+            self.submit_add(job, list_type, entry_details)
+
+    def submit_add(self, job, list_type, entry_details):
+        if not self.subject_registry.claim_add(
+            job.category, entry_details.id, list_type
+        ):
+            metrics.increase("deduplicated_entries_total", stage="adds")
+            job.complete_entry(list_type, entry_details.id)
+            logger.info(
+                '"{}" has been added from another list of this run, skipping it.',
+                entry_details.titles,
+            )
+            return
+        job.start_adding()
+        self.matcher_stage.put((job, list_type, entry_details))
+
+    def get_servarr(self, type):
+        if "Series" == type:
+            return self.sonarr
+        elif "Movie" == type:
+            return self.radarr
+        # elif "Book" == type: # TODO: Implement this
+        elif "Music" == type:
+            return self.lidarr
+        return None
+
+    def match_entry(self, item):
+        job, list_type, entry_details = item
+        try:
+            servarr = self.get_servarr(entry_details.type)
+            if servarr is None:
+                # There is nothing to add it to
+                job.complete_entry(list_type, entry_details.id)
+                if job.finish_adding():
+                    self.complete_job(job)
+                return
+            # The external lookups of the entries not in the library run here, ahead of the adds
+            resolved_ids = None
+            if servarr.find_added_item(entry_details) is None:
+                resolved_ids = servarr.resolve_external_ids(entry_details)
+        except Exception:
+            if job.finish_adding():
+                self.complete_job(job)
+            raise
+        self.writer_stage.put((job, list_type, entry_details, resolved_ids))
+
+    def write_entry(self, item):
+        job, list_type, entry_details, resolved_ids = item
+        try:
+            if self.add_entry(entry_details, list_type, resolved_ids):
+                pending_item_id = self.get_pending_tag_item_id(entry_details)
+                if pending_item_id is None:
+                    job.complete_added_entry(list_type, entry_details.id)
+                else:
+                    # Completed by complete_job, once the tag update has reached the server
+                    job.defer_entry(
+                        list_type, entry_details.id, entry_details.type, pending_item_id
                     )
-                    continue
-                entry_details["titles"] = user_entry["titles"]
-                entry_details_lists[list_type].append(entry_details)
-                if instant_add:
-                    self.add_entry(entry_details, list_type)
-
-        if len(entry_details_lists) > 0:
-            self.save_lists("entry_details", category, entry_details_lists)
-        return entry_details_lists
-
-    def load_lists(self, list_file_path):
-        user_entries_lists = {}
-        entry_details_lists = {}
-        with open(list_file_path, "r", encoding="utf-8") as file:
-            loaded_list = json.load(file)
-            if "user_entries" in list_file_path:
-                user_entries_lists = loaded_list
-            elif "entry_details" in list_file_path:
-                entry_details_lists = loaded_list
+            self.record_subject_mapping(job.category, entry_details)
+        finally:
+            if job.finish_adding():
+                self.complete_job(job)
+
+    def complete_job(self, job):
+        self.complete_deferred_entries(job)
+        # The entries are only seen once they have been added, the entries that failed are retried by the next runs
+        if self.scraping_state is not None and job.mode == "scrape_and_add":
+            with self.scraping_state_lock:
+                for list_type in job.list_types:
+                    # The older entries of an incomplete list haven't been scraped yet
+                    if list_type in job.unfinished_list_types:
+                        continue
+                    self.scraping_state.update(
+                        job.user_id,
+                        job.category,
+                        list_type,
+                        job.added_dates.get(list_type, {}),
+                        job.get_completed_ids(list_type),
+                    )
+                self.scraping_state.save()
+        if job.checkpoint is not None:
+            if len(job.unfinished_list_types) > 0:
+                # Kept for the next run to resume the incomplete lists
+                job.checkpoint.close()
             else:
-                logger.error(
-                    "Trying to load an unsupported list file '{}'.",
-                    list_file_path,
-                )
-        return [user_entries_lists, entry_details_lists]
+                job.checkpoint.complete()
+        logger.info(
+            "Finished the list(s) {} of category '{}' for user {}.",
+            job.list_types,
+            job.category,
+            job.user_id,
+        )
 
-    def save_lists(self, file_type, category, lists):
+    def create_list_file_writer(self, file_type, category, user_id):
         dir_name = "lists"
         cwd = os.getcwd()
         dir_path = cwd + os.sep + dir_name
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
 
         file_name = (
             datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             + "_%s" % file_type
             + "_%s" % category
-            + ".list"
+            + "_%s" % user_id
+            + ".jsonl"
         )
-        file_path = dir_path + os.sep + file_name
+        return ListFileWriter(dir_path + os.sep + file_name)
 
-        logger.info("Saving the '{}_{}' list to {}.", file_type, category, file_path)
-        with open(file_path, "w", encoding="utf-8") as list_file:
-            json_obj = json.dumps(lists, indent=4, sort_keys=True)
-            list_file.write(json_obj)
+    def flush_tag_updates(self):
+        for servarr in self.get_created_servarrs():
+            servarr.flush_tag_updates()
 
-    def add_entry(self, entry_details, list_type):
-        type = entry_details["type"]
-        if "Series" == type:
-            self.sonarr.try_to_add_item(entry_details, list_type)
-        elif "Movie" == type:
-            self.radarr.try_to_add_item(entry_details, list_type)
-        # elif "Book" == type: # TODO: Implement this
-        elif "Music" == type:
-            self.lidarr.try_to_add_item(entry_details, list_type)
+    def get_pending_tag_item_id(self, entry_details):
+        servarr = self.get_servarr(entry_details.type)
+        if servarr is None:
+            return None
+        added_item = servarr.find_added_item(entry_details)
+        if added_item is None or not servarr.has_pending_tag_update(
+            added_item.get("id")
+        ):
+            return None
+        return added_item["id"]
+
+    def complete_deferred_entries(self, job):
+        # The tag updates queued by the job's entries are sent before the job is completed.
+        # The entries whose updates didn't make it stay uncompleted, so the next runs retry them.
+        deferred_entries = job.get_deferred_entries()
+        if len(deferred_entries) == 0:
+            return
+        for type in set(type for _, _, type, _ in deferred_entries):
+            self.get_servarr(type).flush_tag_updates()
+        for list_type, id, type, servarr_id in deferred_entries:
+            if self.get_servarr(type).has_pending_tag_update(servarr_id):
+                logger.warning(
+                    "The tag update of entry {} hasn't reached the server, it will be retried.",
+                    id,
+                )
+                continue
+            job.complete_added_entry(list_type, id)
+
+    def save_snapshots(self):
+        for servarr in self.get_created_servarrs():
+            servarr.save_snapshots()
+
+    def add_entry(self, entry_details, list_type, resolved_ids=None):
+        # Returns whether the entry is in the library, its tag update could still be queued
+        type = entry_details.type
+        if type not in self.add_locks:
+            return True
+        with self.add_locks[type]:
+            return self.get_servarr(type).try_to_add_item(
+                entry_details, list_type, resolved_ids
+            )
+
+
+class UserListsJob:
+    def __init__(
+        self,
+        user_id,
+        category,
+        list_types,
+        start_date,
+        end_date,
+        start_page,
+        mode="scrape_and_add",
+        instant_add=True,
+        list_file_path="",
+    ):
+        self.user_id = user_id
+        self.category = category
+        self.list_types = list_types
+        self.start_date = start_date
+        self.end_date = end_date
+        self.start_page = start_page
+        self.mode = mode
+        self.instant_add = instant_add
+        self.list_file_path = list_file_path
+        self.checkpoint = None
+        # list_type -> {id: the date the entry was marked}, all the scraping state needs.
+        # The entries themselves are only kept while they go through the stages.
+        self.added_dates = {}
+        # list_type -> ids of the entries detailed and added successfully
+        self.completed_ids = {}
+        # (list_type, id, type, servarr id) of the added entries whose tag updates are still queued
+        self.deferred_entries = []
+        # The list types the crawler couldn't scrape to the end
+        self.unfinished_list_types = set()
+        self.entry_details_writer = None
+        self.entry_details_file_path = None
+
+        # The job's entries are spread over the stages, these tell when each phase is done
+        self.lock = threading.Lock()
+        self.is_scraping = True
+        self.pending_entry_details = 0
+        self.is_detailing = True
+        self.pending_adds = 0
+
+    def start_entry_details(self):
+        with self.lock:
+            self.pending_entry_details += 1
+
+    def finish_entry_details(self):
+        # Returns True for the only caller that should finish the detailing phase
+        with self.lock:
+            self.pending_entry_details -= 1
+            return not self.is_scraping and self.pending_entry_details == 0
+
+    def finish_scraping(self):
+        with self.lock:
+            self.is_scraping = False
+            return self.pending_entry_details == 0
+
+    def write_entry_details(self, list_type, entry_details):
+        with self.lock:
+            self.entry_details_writer.write(list_type, entry_details)
+
+    def complete_entry(self, list_type, id):
+        with self.lock:
+            self.completed_ids.setdefault(list_type, set()).add(id)
+
+    def record_entry(self, list_type, user_entry):
+        # Only called by the job's scraper
+        self.added_dates.setdefault(list_type, {})[
+            user_entry.id
+        ] = user_entry.added_date
+
+    def complete_added_entry(self, list_type, id):
+        self.complete_entry(list_type, id)
+        if self.checkpoint is not None:
+            self.checkpoint.record_added(list_type, id)
+
+    def defer_entry(self, list_type, id, type, servarr_id):
+        with self.lock:
+            self.deferred_entries.append((list_type, id, type, servarr_id))
+
+    def get_deferred_entries(self):
+        with self.lock:
+            return list(self.deferred_entries)
+
+    def get_completed_ids(self, list_type):
+        with self.lock:
+            return set(self.completed_ids.get(list_type, set()))
+
+    def is_added(self, list_type, id):
+        return self.checkpoint is not None and self.checkpoint.is_added(list_type, id)
+
+    def start_adding(self):
+        with self.lock:
+            self.pending_adds += 1
+
+    def finish_adding(self):
+        # Returns True for the only caller that should complete the job
+        with self.lock:
+            self.pending_adds -= 1
+            return not self.is_detailing and self.pending_adds == 0
+
+    def finish_detailing(self):
+        with self.lock:
+            self.is_detailing = False
+            return self.pending_adds == 0
@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+
+from loguru import logger
+
+from utils.metrics import metrics
+
+
+class Stage:
+    STOP = object()
+
+    def __init__(self, name, handler, workers=1, queue_size=0):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        # A full queue blocks the upstream stage, so a slow stage holds the faster ones back instead of piling up the work
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self.run, name="%s_%s" % (self.name, i), daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is Stage.STOP:
+                break
+            started_at = time.perf_counter()
+            result = "done"
+            try:
+                self.handler(item)
+            except Exception as e:
+                result = "failed"
+                logger.exception(
+                    "The {} stage failed to process an item: {}", self.name, e
+                )
+            metrics.observe(
+                "pipeline_stage_duration_seconds",
+                time.perf_counter() - started_at,
+                stage=self.name,
+            )
+            metrics.increase(
+                "pipeline_stage_items_total", stage=self.name, result=result
+            )
+
+    def stop(self):
+        for thread in self.threads:
+            self.queue.put(Stage.STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class Pipeline:
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, handler, workers=1, queue_size=0):
+        stage = Stage(name, handler, workers, queue_size)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def join(self):
+        # The stages are stopped from the upstream to the downstream, so every item handed down is processed before a stage stops
+        for stage in self.stages:
+            stage.stop()
@@ -18,6 +18,8 @@ class Radarr(Servarr):
         addOptions={},
         qualityProfileId=1,
         minimumAvailability="",
+        cache_dir=None,
+        library_cache_max_age_secs=0,
     ):
         Servarr.__init__(
             self,
@@ -32,6 +34,8 @@ class Radarr(Servarr):
             monitored,
             addOptions,
             qualityProfileId,
+            cache_dir,
+            library_cache_max_age_secs,
         )
         self.minimumAvailability = minimumAvailability
 
@@ -54,22 +58,24 @@ class Radarr(Servarr):
             return "watched"
         return None
 
-    def get_apply_tags_data(self, servarr_object_info, found_added_tag_id):
+    def get_apply_tags_data(self, servarr_object_ids, found_added_tag_id):
         data = {}
-        data["movieIds"] = []
-        data["movieIds"].append(servarr_object_info["id"])
+        data["movieIds"] = servarr_object_ids
         data["tags"] = []
         data["tags"].append(found_added_tag_id)
         return data
 
+    def get_item_external_ids(self, item):
+        return [item.get("imdbId")]
+
     def is_any_matching(self, external_id, searching_titles, item):
         is_external_id_matching = "imdbId" in item and item["imdbId"] == external_id
         is_title_matching = "title" in item and item["title"] in searching_titles
         return is_external_id_matching or is_title_matching
 
-    def search_and_add(self, caller_object_details, list_type):
-        external_id = caller_object_details["external_id"]
-        titles = caller_object_details["titles"]
+    def search_and_add(self, caller_object_details, list_type, resolved_ids=None):
+        external_id = caller_object_details.external_id
+        titles = caller_object_details.titles
         if external_id is not None:
             external_id = external_id.strip()
             if self.try_to_add_by_term(
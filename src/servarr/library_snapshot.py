@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import time
+
+from loguru import logger
+
+from utils.file_utils import load_json
+from utils.file_utils import write_json_atomically
+
+
+class LibrarySnapshot:
+    def __init__(self, file_path, max_age_secs=0):
+        self.file_path = file_path
+        # The validators and the fetching time are kept beside the library, so revalidating it doesn't rewrite the whole library
+        self.meta_file_path = file_path + ".meta"
+        # Within this age the snapshot is used without asking the server, 0 means always revalidating it
+        self.max_age_secs = max_age_secs
+        self.content = None
+        self.etag = None
+        self.last_modified = None
+        # The hash of the server's response the content was decoded from, None once it has been changed locally
+        self.content_hash = None
+        self.fetched_at = 0
+        self.is_dirty = False
+        self.is_meta_dirty = False
+
+        if os.path.exists(self.file_path) and os.path.exists(self.meta_file_path):
+            meta = load_json(self.meta_file_path, None, "the library snapshot's meta")
+            if meta is not None:
+                self.content = load_json(self.file_path, None, "the library snapshot")
+            if self.content is not None:
+                try:
+                    self.etag = meta["etag"]
+                    self.last_modified = meta["last_modified"]
+                    self.content_hash = meta["content_hash"]
+                    self.fetched_at = meta["fetched_at"]
+                except (TypeError, KeyError) as e:
+                    logger.warning(
+                        "Unable to load the library snapshot '{}': {}",
+                        self.file_path,
+                        e,
+                    )
+                    self.content = None
+
+    def is_fresh(self):
+        return (
+            self.content is not None
+            and self.max_age_secs > 0
+            and time.time() - self.fetched_at < self.max_age_secs
+        )
+
+    def get_conditional_headers(self):
+        headers = {}
+        if self.content is None:
+            return headers
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def revalidate(self):
+        # The server says nothing has changed since the snapshot
+        self.fetched_at = time.time()
+        self.is_meta_dirty = True
+        self.save()
+
+    def update(self, raw_content, etag, last_modified):
+        # Returns the decoded library. The Servarr servers don't send any validators, so an unchanged library is told by its hash
+        content_hash = hashlib.sha256(raw_content).hexdigest()
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.time()
+        self.is_meta_dirty = True
+        if self.content is None or content_hash != self.content_hash:
+            self.content = json.loads(raw_content)
+            self.content_hash = content_hash
+            self.is_dirty = True
+        self.save()
+        return self.content
+
+    def mark_dirty(self):
+        # The content has been changed locally, e.g. by adding an item, so the server's validators don't match it anymore
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.is_dirty = True
+        self.is_meta_dirty = True
+
+    def save(self):
+        if self.content is None or not (self.is_dirty or self.is_meta_dirty):
+            return
+        if self.is_dirty:
+            write_json_atomically(self.file_path, self.content, ensure_ascii=False)
+            self.is_dirty = False
+        write_json_atomically(
+            self.meta_file_path,
+            {
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "content_hash": self.content_hash,
+                "fetched_at": self.fetched_at,
+            },
+        )
+        self.is_meta_dirty = False
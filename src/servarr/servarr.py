@@ -1,7 +1,12 @@
 import json
+import os
+import re
+import threading
 
 from loguru import logger
 
+from servarr.library_snapshot import LibrarySnapshot
+from utils.metrics import metrics
 from utils.request_utils import RequestUtils
 
 
@@ -19,16 +24,22 @@ class Servarr:
         monitored=True,
         addOptions={},
         qualityProfileId=1,
+        cache_dir=None,
+        library_cache_max_age_secs=0,
     ):
         self.api_type = api_type
         self.api_version = api_version
         self.request_wrapper = RequestUtils(
             request_interval_mode=True,
             max_attempt=6,
-            min_request_interval_in_ms=200,
-            max_request_interval_in_ms=500,
-            min_sleep_secs=0.1,
-            max_sleep_secs=0.2,
+            request_rate=10.0,
+            request_burst=10,
+            # The external metadata sources are paced separately from the Servarr server
+            host_request_limits={
+                "www.imdb.com": {"rate": 1.0, "burst": 2, "jitter_secs": 0.5},
+                "thetvdb.com": {"rate": 1.0, "burst": 2},
+                "musicbrainz.org": {"rate": 1.0, "burst": 1},
+            },
         )
         self.host = host
         self.port = port
@@ -44,22 +55,79 @@ class Servarr:
             port if url_base == "" else url_base,
         )
 
+        # The library is kept on disk, so it isn't downloaded again within its max age, nor decoded and saved again if it hasn't changed
+        self.tags_snapshot = None
+        self.added_items_snapshot = None
+        if cache_dir is not None:
+            snapshot_name = "%s_%s" % (self.api_type, re.sub(r"\W+", "_", self.server))
+            self.tags_snapshot = LibrarySnapshot(
+                os.path.join(cache_dir, snapshot_name + "_tags.json"),
+                library_cache_max_age_secs,
+            )
+            self.added_items_snapshot = LibrarySnapshot(
+                os.path.join(cache_dir, snapshot_name + "_items.json"),
+                library_cache_max_age_secs,
+            )
+
         self.tags = self.get_added_tags()
+        self.missing_tag_labels = []
         self.try_to_create_tags()
         self.update_tags()
 
         self.added_items = self.get_added_items()
+        self.build_added_item_indexes()
+        # (applyTags, tag label, tag id) -> item ids, applied by flush_tag_updates
+        self.pending_tag_updates = {}
+        # The jobs flush the updates while the others keep queuing theirs
+        self.tag_updates_lock = threading.Lock()
 
     def try_to_create_tags(self):
         pass
 
+    def get_with_snapshot(self, api, snapshot):
+        if snapshot is not None and snapshot.is_fresh():
+            logger.info("Using the saved snapshot of {}{}.", self.server, api)
+            return snapshot.content
+
+        headers = dict(self.headers)
+        if snapshot is not None:
+            headers.update(snapshot.get_conditional_headers())
+        r = self.request_wrapper.get(self.server + api, headers=headers)
+        if r is None or (r.status_code != 200 and r.status_code != 304):
+            if snapshot is not None and snapshot.content is not None:
+                logger.warning(
+                    "Unable to get {}{}, using the outdated snapshot instead.",
+                    self.server,
+                    api,
+                )
+                return snapshot.content
+            return None
+
+        if r.status_code == 304 and snapshot is not None:
+            logger.info(
+                "{}{} hasn't changed since the last snapshot.", self.server, api
+            )
+            snapshot.revalidate()
+            return snapshot.content
+
+        # Decode the raw bytes directly, the response could be tens of MB
+        if snapshot is not None:
+            return snapshot.update(
+                r.content, r.headers.get("ETag"), r.headers.get("Last-Modified")
+            )
+        return json.loads(r.content)
+
+    def save_snapshots(self):
+        if self.tags_snapshot is not None:
+            self.tags_snapshot.save()
+        # The local items carry the queued tag changes, they're saved only once the server has them all
+        if self.added_items_snapshot is not None and not self.has_pending_tag_updates():
+            self.added_items_snapshot.save()
+
     def get_added_tags(self):
         api = "/api/%s/tag" % self.api_version
-        r = self.request_wrapper.get_and_return_content(
-            self.server + api, headers=self.headers
-        )
-        if r is not None:
-            result = json.loads(r)
+        result = self.get_with_snapshot(api, self.tags_snapshot)
+        if result is not None:
             logger.info("Already added tags: {}", result)
             return result
         else:
@@ -69,30 +137,39 @@ class Servarr:
             return None
 
     def try_to_create_tag(self, label):
+        if self.tags is None:
+            return
         found_tag = self.find_tag_by_label(label, self.tags)
-        new_tag = {}
-        if found_tag is not None and len(found_tag) == 0:
-            new_tag["label"] = label
-            new_tag["id"] = len(self.tags) + 1
-            self.tags.append(new_tag)
+        if len(found_tag) == 0 and label not in self.missing_tag_labels:
+            self.missing_tag_labels.append(label)
             logger.info('New tag "{}" needs to be added.', label)
 
     def update_tags(self):
-        if self.tags is None:
+        # Only the labels the server doesn't have yet are created, the ids are assigned by the server
+        if self.tags is None or len(self.missing_tag_labels) == 0:
             return None
         api = "/api/%s/tag" % self.api_version
-        for tag in self.tags:
+        for label in self.missing_tag_labels:
             r = self.request_wrapper.post(
-                self.server + api, data=json.dumps(tag), headers=self.headers
+                self.server + api,
+                data=json.dumps({"label": label}),
+                headers=self.headers,
             )
             if r is None:
-                return None
-            # TODO: This would return a 500 and saying "Can't insert model with existing ID x" if the ID x is not added yet...
+                logger.warning('Can\'t add tag "{}"', label)
+                continue
             if r.status_code != 202 and r.status_code != 201:
-                logger.warning('Can\'t add tag "{}"', tag)
+                logger.warning('Can\'t add tag "{}"', label)
+                continue
+            new_tag = json.loads(r.content)
+            self.tags.append(new_tag)
+            logger.info('Added tag "{}" with id {}.', new_tag["label"], new_tag["id"])
+            if self.tags_snapshot is not None:
+                self.tags_snapshot.mark_dirty()
+        self.missing_tag_labels = []
 
     def find_tag_by_label(self, label, tags):
-        if tags is not None and len(tags) > 0:
+        if tags is not None:
             return list(filter(lambda tag: tag["label"] == label, tags))
         return None
 
@@ -110,29 +187,20 @@ class Servarr:
             return False
 
         self.remove_old_tags(servarr_object_info)
-
-        api = "/api/%s/%s/editor" % (self.api_version, self.api_type)
-        data = self.get_apply_tags_data(servarr_object_info, found_added_tag_id)
-        data["applyTags"] = "add"
-        r = self.request_wrapper.put(
-            self.server + api, data=json.dumps(data), headers=self.headers
+        self.queue_tag_update(
+            servarr_object_info, new_tag_label, found_added_tag_id, "add"
         )
-        if r is None:
-            return None
-        if r.status_code == 202:
-            logger.info(
-                'Successfully updated the status tag of {} to "{}".',
-                servarr_object_info["title"],
-                found_added_tags[0]["label"],
-            )
-            return True
-        else:
-            return None
+        logger.info(
+            'The status tag of {} will be updated to "{}".',
+            servarr_object_info["title"],
+            new_tag_label,
+        )
+        return True
 
     def remove_old_tags(self, servarr_object_info):
         pass
 
-    def get_apply_tags_data(self, servarr_object_info, found_added_tag_id):
+    def get_apply_tags_data(self, servarr_object_ids, found_added_tag_id):
         return {}
 
     def list_type_to_tag_label(self, list_type):
@@ -147,72 +215,223 @@ class Servarr:
         if found_added_tag_id not in servarr_object_info["tags"]:
             return False
 
-        api = "/api/%s/%s/editor" % (self.api_version, self.api_type)
-        data = self.get_apply_tags_data(servarr_object_info, found_added_tag_id)
-        data["applyTags"] = "remove"
-        r = self.request_wrapper.put(
-            self.server + api, data=json.dumps(data), headers=self.headers
+        self.queue_tag_update(
+            servarr_object_info, old_tag_label, found_added_tag_id, "remove"
         )
-        if r is None:
-            return None
-        if r.status_code == 202:
-            logger.info(
-                'Successfully removed the tag "{}" of {}.',
-                old_tag_label,
-                servarr_object_info["title"],
+        return True
+
+    def queue_tag_update(self, servarr_object_info, tag_label, tag_id, apply_tags):
+        with self.tag_updates_lock:
+            # The local item follows the queued changes, so the same item showing up again in this run sees its new tags
+            if apply_tags == "add":
+                servarr_object_info["tags"].append(tag_id)
+                opposite_apply_tags = "remove"
+            else:
+                servarr_object_info["tags"].remove(tag_id)
+                opposite_apply_tags = "add"
+
+            # Undoing a change the server hasn't seen yet
+            opposite_key = (opposite_apply_tags, tag_label, tag_id)
+            if servarr_object_info["id"] in self.pending_tag_updates.get(
+                opposite_key, set()
+            ):
+                self.pending_tag_updates[opposite_key].discard(
+                    servarr_object_info["id"]
+                )
+                return
+
+            key = (apply_tags, tag_label, tag_id)
+            self.pending_tag_updates.setdefault(key, set()).add(
+                servarr_object_info["id"]
+            )
+
+    def flush_tag_updates(self):
+        api = "/api/%s/%s/editor" % (self.api_version, self.api_type)
+        with self.tag_updates_lock:
+            # The failed updates stay queued and are sent again by the next flush
+            failed_tag_updates = {}
+            # One request per tag, the old tags are removed before the new ones are added
+            for key in sorted(
+                self.pending_tag_updates, key=lambda key: key[0] == "add"
+            ):
+                apply_tags, tag_label, tag_id = key
+                servarr_object_ids = sorted(self.pending_tag_updates[key])
+                if len(servarr_object_ids) == 0:
+                    continue
+                data = self.get_apply_tags_data(servarr_object_ids, tag_id)
+                data["applyTags"] = apply_tags
+                r = self.request_wrapper.put(
+                    self.server + api, data=json.dumps(data), headers=self.headers
+                )
+                if r is not None and r.status_code == 202:
+                    metrics.increase(
+                        "servarr_tagged_items_total",
+                        len(servarr_object_ids),
+                        backend=self.api_type,
+                        apply_tags=apply_tags,
+                    )
+                    logger.info(
+                        'Successfully {} the tag "{}" for {} item(s).',
+                        "added" if apply_tags == "add" else "removed",
+                        tag_label,
+                        len(servarr_object_ids),
+                    )
+                    if self.added_items_snapshot is not None:
+                        self.added_items_snapshot.mark_dirty()
+                else:
+                    logger.warning(
+                        'Failed to {} the tag "{}" for {} item(s). There might be server-side issues. They are kept for the next flush.',
+                        apply_tags,
+                        tag_label,
+                        len(servarr_object_ids),
+                    )
+                    failed_tag_updates[key] = self.pending_tag_updates[key]
+            self.pending_tag_updates = failed_tag_updates
+
+    def has_pending_tag_updates(self):
+        with self.tag_updates_lock:
+            return any(
+                len(servarr_object_ids) > 0
+                for servarr_object_ids in self.pending_tag_updates.values()
             )
-            return True
-        else:
-            return None
+
+    def has_pending_tag_update(self, servarr_id):
+        with self.tag_updates_lock:
+            return any(
+                servarr_id in servarr_object_ids
+                for servarr_object_ids in self.pending_tag_updates.values()
+            )
+
+    def refresh_library(self):
+        tags = self.get_added_tags()
+        if tags is not None:
+            self.tags = tags
+            self.try_to_create_tags()
+            self.update_tags()
+
+        # The unchanged library comes back from the snapshot as it is, so the indexes are still valid
+        added_items = self.get_added_items()
+        if added_items is not None and added_items is not self.added_items:
+            self.added_items = added_items
+            self.build_added_item_indexes()
 
     def get_added_items(self):
         api = "/api/%s/%s" % (self.api_version, self.api_type)
-        r = self.request_wrapper.get_and_return_content(
-            self.server + api, headers=self.headers
-        )
-        if r is not None:
-            return json.loads(r)
+        result = self.get_with_snapshot(api, self.added_items_snapshot)
+        if result is not None:
+            return result
         else:
             logger.warning("Trying to get the added items but the result is none.")
             return None
 
-    def try_to_add_item(self, caller_object_details, list_type):
-        titles = caller_object_details["titles"]
+    def try_to_add_item(self, caller_object_details, list_type, resolved_ids=None):
+        titles = caller_object_details.titles
         added_item = self.find_added_item(caller_object_details)
         if added_item is not None:
-            watching_status_update_result = self.try_to_update_status_tags(
-                added_item, list_type
+            return self.update_added_item(added_item, titles, list_type)
+        logger.info('Trying to add"{}"...', titles)
+        return self.search_and_add(caller_object_details, list_type, resolved_ids)
+
+    def resolve_external_ids(self, caller_object_details):
+        # The lookups on the external sites needed by search_and_add. They don't touch the library, so they could run ahead of the adds
+        return None
+
+    def update_added_item(self, added_item, titles, list_type):
+        watching_status_update_result = self.try_to_update_status_tags(
+            added_item, list_type
+        )
+        if watching_status_update_result is not None:
+            if watching_status_update_result == False:
+                logger.info('"{}" has already been added. Skip the process.', titles)
+            return True
+        logger.warning(
+            'Failed to update the watching status of "{}". There might be server-side issues.',
+            titles,
+        )
+        return False
+
+    def build_added_item_indexes(self):
+        self.added_items_by_id = {}
+        self.added_items_by_external_id = {}
+        self.added_items_by_title = {}
+        if self.added_items is not None:
+            for item in self.added_items:
+                self.index_added_item(item)
+
+    def index_added_item(self, item):
+        if "id" in item:
+            self.added_items_by_id[item["id"]] = item
+        for external_id in self.get_known_external_ids(item):
+            self.added_items_by_external_id.setdefault(external_id, []).append(item)
+        if "title" in item and item["title"] is not None:
+            self.added_items_by_title.setdefault(item["title"].casefold(), []).append(
+                item
             )
-            if watching_status_update_result is not None:
-                if watching_status_update_result == False:
-                    logger.info(
-                        '"{}" has already been added. Skip the process.', titles
-                    )
-            else:
-                logger.warning(
-                    'Failed to update the watching status of "{}". There might be server-side issues.',
-                    titles,
-                )
-        else:
-            logger.info('Trying to add"{}"...', titles)
-            self.search_and_add(caller_object_details, list_type)
 
-    # TODO: A query would be cheaper than this O(N) for a large item list
+    def get_item_external_ids(self, item):
+        return []
+
+    def get_known_external_ids(self, item):
+        return [
+            str(external_id)
+            for external_id in self.get_item_external_ids(item)
+            if external_id is not None and external_id != ""
+        ]
+
     def find_added_item(self, caller_object_details):
-        external_id = caller_object_details["external_id"].strip()
+        # The subjects matched by the earlier runs are found by their ids in the library, without comparing anything
+        servarr_id = caller_object_details.servarr_id
+        if servarr_id is not None and servarr_id in self.added_items_by_id:
+            metrics.increase(
+                "servarr_index_lookups_total", backend=self.api_type, result="hit"
+            )
+            return self.added_items_by_id[servarr_id]
+        external_id = caller_object_details.external_id.strip()
         searching_titles = self.get_searching_titles(caller_object_details)
-        if self.added_items is not None:
-            for item in self.added_items:
-                if self.is_any_matching(external_id, searching_titles, item):
-                    return item
+        # The indexes only narrow down the candidates, the matching rules are still decided by is_any_matching
+        candidates = []
+        if external_id != "":
+            candidates.extend(self.added_items_by_external_id.get(external_id, []))
+        for searching_title in searching_titles:
+            candidates.extend(
+                self.added_items_by_title.get(searching_title.casefold(), [])
+            )
+        for item in candidates:
+            if self.is_any_matching(external_id, searching_titles, item):
+                metrics.increase(
+                    "servarr_index_lookups_total", backend=self.api_type, result="hit"
+                )
+                return item
+        metrics.increase(
+            "servarr_index_lookups_total", backend=self.api_type, result="miss"
+        )
+        return None
+
+    def find_added_item_by_id(self, servarr_id):
+        return self.added_items_by_id.get(servarr_id)
+
+    def find_identified_item(self, caller_object_details):
+        # The item the subject is known to be by its ids, unlike find_added_item the titles could match another item
+        if caller_object_details.servarr_id is not None:
+            return self.find_added_item_by_id(caller_object_details.servarr_id)
+        if caller_object_details.external_id.strip() != "":
+            return self.find_added_item_by_external_id(
+                caller_object_details.external_id
+            )
+        return None
+
+    def find_added_item_by_external_id(self, external_id):
+        found_items = self.added_items_by_external_id.get(str(external_id).strip(), [])
+        if len(found_items) > 0:
+            return found_items[0]
         return None
 
     def is_any_matching(self, external_id, searching_titles, item):
         return False
 
     # Searching-by-titles is generally not as accurate as the ID-based searching. This is an example implementation and shouldn't be used in general.
-    def search_and_add(self, caller_object_details, list_type):
-        titles = caller_object_details["titles"]
+    def search_and_add(self, caller_object_details, list_type, resolved_ids=None):
+        titles = caller_object_details.titles
         searching_titles = self.get_searching_titles(caller_object_details)
         for searching_title in searching_titles:
             if self.try_to_add_by_term(
@@ -229,12 +448,13 @@ class Servarr:
         return False
 
     def get_searching_titles(self, caller_object_details):
-        searching_titles = caller_object_details["titles"]
-        if "aliases" in caller_object_details:
-            searching_titles.extend(caller_object_details["aliases"])
+        searching_titles = list(caller_object_details.titles)
+        if caller_object_details.aliases is not None:
+            searching_titles.extend(caller_object_details.aliases)
         return searching_titles
 
     def search_item_by_term(self, term):
+        metrics.increase("servarr_lookups_total", backend=self.api_type)
         api = "/api/%s/%s/lookup" % (self.api_version, self.api_type)
         r = self.request_wrapper.get_and_return_content(
             self.server + api, params={"term": term}, headers=self.headers
@@ -247,7 +467,7 @@ class Servarr:
     def try_to_add_by_term(self, term, caller_object_details, list_type):
         found_items = self.search_item_by_term(term)
         if found_items is not None and len(found_items) > 0:
-            external_id = caller_object_details["external_id"]
+            external_id = caller_object_details.external_id
             searching_titles = self.get_searching_titles(caller_object_details)
             for found_item in found_items:
                 if self.is_any_matching(external_id, searching_titles, found_item):
@@ -262,19 +482,57 @@ class Servarr:
         r = self.request_wrapper.post(
             self.server + api, data=json.dumps(params), headers=self.headers
         )
+        if r is None:
+            metrics.increase(
+                "servarr_adds_total", backend=self.api_type, result="failed"
+            )
+            logger.error(
+                'Failed to add: "{}", {} is unreachable.',
+                (caller_object_details.titles),
+                self.server,
+            )
+            return None
+        if r.status_code >= 500:
+            # Not retried, the item could have been added anyway. The next run finds it in the library or adds it again
+            metrics.increase(
+                "servarr_adds_total", backend=self.api_type, result="failed"
+            )
+            logger.error(
+                'Failed to add: "{}", {} answered {}.',
+                (caller_object_details.titles),
+                self.server,
+                r.status_code,
+            )
+            return None
         content = json.loads(str(r.content, "UTF-8"))
         if r.status_code == 201:
+            metrics.increase(
+                "servarr_adds_total", backend=self.api_type, result="added"
+            )
+            if self.added_items is None:
+                self.added_items = []
+            self.added_items.append(content)
+            self.index_added_item(content)
+            caller_object_details.servarr_id = content.get("id")
+            if self.added_items_snapshot is not None:
+                self.added_items_snapshot.mark_dirty()
             return True
         # TODO: Better parse this and filter out the already-added case
         elif len(content) > 0:
+            metrics.increase(
+                "servarr_adds_total", backend=self.api_type, result="rejected"
+            )
             logger.info(
                 'Failed to add "{}". The server says: "{}".',
-                (caller_object_details["titles"]),
+                (caller_object_details.titles),
                 content,
             )
             return False
         else:
-            logger.error('Failed to add: "{}".', (caller_object_details["titles"]))
+            metrics.increase(
+                "servarr_adds_total", backend=self.api_type, result="failed"
+            )
+            logger.error('Failed to add: "{}".', (caller_object_details.titles))
             return None
 
     def get_add_call_params(
@@ -1,10 +1,12 @@
 import json
+import os
 
 from loguru import logger
 from lxml import etree
 from lxml import html
 
 from servarr.servarr import Servarr
+from utils.persistent_cache import PersistentCache
 
 
 class Sonarr(Servarr):
@@ -23,6 +25,10 @@ class Sonarr(Servarr):
         seriesType="Standard",
         addSeasonSubfolder=True,
         genreSubfolderPath=[],
+        cache_dir=None,
+        library_cache_max_age_secs=0,
+        external_id_cache_ttl_days=90,
+        external_id_cache_miss_ttl_hours=24,
     ):
         Servarr.__init__(
             self,
@@ -37,11 +43,39 @@ class Sonarr(Servarr):
             monitored,
             addOptions,
             qualityProfileId,
+            cache_dir,
+            library_cache_max_age_secs,
         )
         self.languageProfileId = languageProfileId
         self.seriesType = seriesType
         self.addSeasonSubfolder = addSeasonSubfolder
         self.genreSubfolderPath = genreSubfolderPath
+        self.headers_for_external_sites = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
+        }
+
+        # The IMDb and TVDB lookups are saved, so the other seasons of a series and the next runs don't repeat them
+        self.series_imdb_id_cache = None
+        self.tvdb_id_cache = None
+        self.tvdb_id_miss_cache = None
+        if cache_dir is not None:
+            cache_file_path = os.path.join(cache_dir, "sonarr_external_ids.sqlite")
+            self.series_imdb_id_cache = PersistentCache(
+                cache_file_path,
+                table="series_imdb_ids",
+                ttl_secs=external_id_cache_ttl_days * 24 * 3600,
+            )
+            self.tvdb_id_cache = PersistentCache(
+                cache_file_path,
+                table="tvdb_ids",
+                ttl_secs=external_id_cache_ttl_days * 24 * 3600,
+            )
+            # The series not on TVDB yet are retried once these entries expire
+            self.tvdb_id_miss_cache = PersistentCache(
+                cache_file_path,
+                table="tvdb_id_misses",
+                ttl_secs=external_id_cache_miss_ttl_hours * 3600,
+            )
 
     def try_to_create_tags(self):
         self.try_to_create_tag("unwatched")
@@ -62,60 +96,51 @@ class Sonarr(Servarr):
             return "watched"
         return None
 
-    def get_apply_tags_data(self, servarr_object_info, found_added_tag_id):
+    def get_apply_tags_data(self, servarr_object_ids, found_added_tag_id):
         data = {}
-        data["movieIds"] = []
-        data["movieIds"].append(servarr_object_info["id"])
+        data["seriesIds"] = servarr_object_ids
         data["tags"] = []
         data["tags"].append(found_added_tag_id)
         return data
 
+    def get_item_external_ids(self, item):
+        return [item.get("imdbId"), item.get("tvdbId")]
+
     def is_any_matching(self, external_id, searching_titles, item):
         is_external_id_matching = "imdbId" in item and item["imdbId"] == external_id
         is_title_matching = "title" in item and item["title"] in searching_titles
         return is_external_id_matching or is_title_matching
 
     # TODO: Sonarr's search engine is based on TVDB which can't always return a good result with an IMDB-originated metadata. It needs to be improved by Sonarr's developers
-    def search_and_add(self, caller_object_details, list_type):
-        external_id = caller_object_details["external_id"]
+    def resolve_external_ids(self, caller_object_details):
+        external_id = caller_object_details.external_id
         if external_id is None:
             return None
-
-        # TODO: Better move this to an earlier stage so we won't be spammed by the different seasons
-        # Try to get the series IMDB ID from the title's page, assuming it's a multi-season series and the external_id provided is the episode's ID
-        imdb_url = "https://www.imdb.com/title/%s" % external_id
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
+        series_imdb_id = self.get_series_imdb_id(external_id)
+        return {
+            "series_imdb_id": series_imdb_id,
+            "tvdb_id": self.get_tvdb_id(series_imdb_id),
         }
-        imdb_res = self.request_wrapper.get(imdb_url, headers=headers)
-        imdb_episode_page = etree.HTML(imdb_res.text)
-        found_series_imdb_url = imdb_episode_page.xpath(
-            '//span[text()="All episodes"]/parent::a/@href'
-        )
 
-        # We're not on the only season page of the series, which means the IMDB ID needs to be replaced
-        if len(found_series_imdb_url) > 0:
-            external_id = found_series_imdb_url[0]
-            first_substring = "/title/"
-            end_substring = "/episodes/"
-            external_id = external_id[
-                external_id.find(first_substring)
-                + len(first_substring) : external_id.find(end_substring)
-            ]
-
-        # Then get the TVDB ID
-        tvdb_url = (
-            "https://thetvdb.com/api/GetSeriesByRemoteID.php?imdbid=%s" % external_id
-        )
-        tvdb_res = self.request_wrapper.get(tvdb_url, headers=headers)
-        tvdb_html = html.fromstring(bytes(tvdb_res.text, encoding="utf8"))
-        tvdb_ids = tvdb_html.xpath("//seriesid/text()")
+    def search_and_add(self, caller_object_details, list_type, resolved_ids=None):
+        if caller_object_details.external_id is None:
+            return None
 
-        titles = caller_object_details["titles"]
-        if tvdb_ids is not None and len(tvdb_ids) > 0:
-            tvdb_id = tvdb_ids[0]
+        if resolved_ids is None:
+            resolved_ids = self.resolve_external_ids(caller_object_details)
+        external_id = resolved_ids["series_imdb_id"]
+        tvdb_id = resolved_ids["tvdb_id"]
+
+        titles = caller_object_details.titles
+        if tvdb_id is not None:
+            # The series could have been added with the IMDB ID of another season
+            added_item = self.find_added_item_by_external_id(tvdb_id)
+            if added_item is not None:
+                # Found by its ids, so the subject is mapped to it like the added items
+                caller_object_details.servarr_id = added_item.get("id")
+                return self.update_added_item(added_item, titles, list_type)
             # To prevent false positives from the matching checker
-            caller_object_details["external_id"] = external_id
+            caller_object_details.external_id = external_id
             if self.try_to_add_by_term(
                 "tvdb:" + tvdb_id, caller_object_details, list_type
             ):
@@ -134,6 +159,72 @@ class Sonarr(Servarr):
         )
         return None
 
+    def get_series_imdb_id(self, imdb_id):
+        if self.series_imdb_id_cache is not None:
+            series_imdb_id = self.series_imdb_id_cache.get(imdb_id)
+            if series_imdb_id is not None:
+                return series_imdb_id
+
+        # Try to get the series IMDB ID from the title's page, assuming it's a multi-season series and the IMDB ID provided is the episode's ID
+        imdb_url = "https://www.imdb.com/title/%s" % imdb_id
+        imdb_res = self.request_wrapper.get(
+            imdb_url, headers=self.headers_for_external_sites
+        )
+        if imdb_res is None or imdb_res.status_code != 200:
+            logger.warning("Unable to get the IMDb page {}.", imdb_url)
+            return imdb_id
+        imdb_episode_page = etree.HTML(imdb_res.content)
+        found_series_imdb_url = imdb_episode_page.xpath(
+            '//span[text()="All episodes"]/parent::a/@href'
+        )
+
+        series_imdb_id = imdb_id
+        # We're not on the only season page of the series, which means the IMDB ID needs to be replaced
+        if len(found_series_imdb_url) > 0:
+            series_imdb_id = found_series_imdb_url[0]
+            first_substring = "/title/"
+            end_substring = "/episodes/"
+            series_imdb_id = series_imdb_id[
+                series_imdb_id.find(first_substring)
+                + len(first_substring) : series_imdb_id.find(end_substring)
+            ]
+        if self.series_imdb_id_cache is not None:
+            self.series_imdb_id_cache.set(imdb_id, series_imdb_id)
+        return series_imdb_id
+
+    def get_tvdb_id(self, series_imdb_id):
+        if self.tvdb_id_cache is not None:
+            tvdb_id = self.tvdb_id_cache.get(series_imdb_id)
+            if tvdb_id is not None:
+                return tvdb_id
+            if self.tvdb_id_miss_cache.get(series_imdb_id) is not None:
+                logger.info(
+                    "{} wasn't found on TVDB recently, skipping the lookup.",
+                    series_imdb_id,
+                )
+                return None
+
+        tvdb_url = (
+            "https://thetvdb.com/api/GetSeriesByRemoteID.php?imdbid=%s" % series_imdb_id
+        )
+        tvdb_res = self.request_wrapper.get(
+            tvdb_url, headers=self.headers_for_external_sites
+        )
+        if tvdb_res is None or tvdb_res.status_code != 200:
+            logger.warning("Unable to get {}.", tvdb_url)
+            return None
+        tvdb_html = html.fromstring(tvdb_res.content)
+        tvdb_ids = tvdb_html.xpath("//seriesid/text()")
+
+        if tvdb_ids is not None and len(tvdb_ids) > 0:
+            tvdb_id = tvdb_ids[0]
+            if self.tvdb_id_cache is not None:
+                self.tvdb_id_cache.set(series_imdb_id, tvdb_id)
+            return tvdb_id
+        if self.tvdb_id_miss_cache is not None:
+            self.tvdb_id_miss_cache.set(series_imdb_id, True)
+        return None
+
     def get_add_call_params(
         self, caller_object_details, servarr_object_info, list_type
     ):
@@ -143,7 +234,7 @@ class Sonarr(Servarr):
         params["languageProfileId"] = self.languageProfileId
         params["seriesType"] = self.seriesType
         params["addSeasonSubfolder"] = self.addSeasonSubfolder
-        genres = caller_object_details["genres"]
+        genres = caller_object_details.genres
         if genres is not None and len(genres) > 0:
             for genre in genres:
                 for t in self.genreSubfolderPath:
@@ -0,0 +1,36 @@
+import threading
+
+from utils.file_utils import load_json
+from utils.file_utils import write_json_atomically
+
+
+class SubjectMappings:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        # "<category>/<douban id>" -> {"type", "servarr_id", "external_ids"}
+        self.mappings = load_json(self.file_path, {}, "the subject mappings")
+        self.is_dirty = False
+
+    def get_key(self, category, id):
+        return "%s/%s" % (category, id)
+
+    def get(self, category, id):
+        return self.mappings.get(self.get_key(category, id))
+
+    def set(self, category, id, mapping):
+        key = self.get_key(category, id)
+        with self.lock:
+            if self.mappings.get(key) == mapping:
+                return
+            self.mappings[key] = mapping
+            self.is_dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.is_dirty:
+                return
+            write_json_atomically(
+                self.file_path, self.mappings, ensure_ascii=False, sort_keys=True
+            )
+            self.is_dirty = False
@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import Future
+
+# The most relevant list type first, it decides the status tag of a subject in several lists of the run
+LIST_TYPE_PRIORITY = ["do", "wish", "collect"]
+
+
+class SubjectRegistry:
+    def __init__(self):
+        # The subjects seen by a run, shared by all the users' jobs
+        self.lock = threading.Lock()
+        # (category, id) -> Future of the entry details
+        self.details = {}
+        # (category, id) -> the list type the subject has been added with
+        self.added_list_types = {}
+
+    def claim_details(self, category, id):
+        # Returns the future of the details, and whether the caller should fetch them
+        key = (category, id)
+        with self.lock:
+            if key in self.details:
+                return self.details[key], False
+            future = Future()
+            self.details[key] = future
+            return future, True
+
+    def release_details(self, category, id):
+        # The callers waiting on the future still have it
+        with self.lock:
+            self.details.pop((category, id), None)
+
+    def claim_add(self, category, id, list_type):
+        # The first add of a subject goes through, the later ones only if their list type is more relevant
+        key = (category, id)
+        with self.lock:
+            added_list_type = self.added_list_types.get(key)
+            if added_list_type is not None and get_list_type_rank(
+                list_type
+            ) >= get_list_type_rank(added_list_type):
+                return False
+            self.added_list_types[key] = list_type
+            return True
+
+
+def get_list_type_rank(list_type):
+    if list_type in LIST_TYPE_PRIORITY:
+        return LIST_TYPE_PRIORITY.index(list_type)
+    return len(LIST_TYPE_PRIORITY)
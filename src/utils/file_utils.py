@@ -0,0 +1,35 @@
+import json
+import os
+
+from loguru import logger
+
+
+def make_parent_dirs(file_path):
+    dir_path = os.path.dirname(file_path)
+    if dir_path != "" and not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+
+
+def load_json(file_path, default, description):
+    # The default is returned for a missing file, and for a broken one which is then started over
+    if not os.path.exists(file_path):
+        return default
+    try:
+        with open(file_path, "rb") as file:
+            content = json.load(file)
+    except (OSError, ValueError) as e:
+        logger.warning(
+            "Unable to load {} from '{}', starting over: {}", description, file_path, e
+        )
+        return default
+    logger.info("Loaded {} from '{}'.", description, file_path)
+    return content
+
+
+def write_json_atomically(file_path, content, **json_kwargs):
+    # Write to a temporary file first so a crash won't leave a broken file behind
+    make_parent_dirs(file_path)
+    temp_file_path = file_path + ".tmp"
+    with open(temp_file_path, "w", encoding="utf-8") as file:
+        json.dump(content, file, **json_kwargs)
+    os.replace(temp_file_path, file_path)
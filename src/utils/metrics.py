@@ -0,0 +1,183 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from loguru import logger
+
+from utils.file_utils import write_json_atomically
+
+# The upper bounds of the duration histograms' buckets, in seconds
+DURATION_BUCKETS_SECS = [0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value, the labels being a sorted tuple of (key, value)
+        self.counters = {}
+        # (name, labels) -> {"buckets": [counts], "count": int, "sum": float}
+        self.histograms = {}
+
+    def get_key(self, name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increase(self, name, value=1, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {
+                    "buckets": [0] * len(DURATION_BUCKETS_SECS),
+                    "count": 0,
+                    "sum": 0.0,
+                }
+                self.histograms[key] = histogram
+            for i, upper_bound in enumerate(DURATION_BUCKETS_SECS):
+                if value <= upper_bound:
+                    histogram["buckets"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def get_snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    key: {
+                        "buckets": list(histogram["buckets"]),
+                        "count": histogram["count"],
+                        "sum": histogram["sum"],
+                    }
+                    for key, histogram in self.histograms.items()
+                },
+            }
+
+    def get_report(self, since=None):
+        # The counters only grow, so the numbers of a single run are the differences from the snapshot taken when it started
+        snapshot = self.get_snapshot()
+        if since is None:
+            since = {"counters": {}, "histograms": {}}
+        report = {"counters": {}, "histograms": {}}
+        for key, value in snapshot["counters"].items():
+            value -= since["counters"].get(key, 0)
+            if value == 0:
+                continue
+            name, labels = key
+            report["counters"].setdefault(name, {})[format_labels(labels)] = value
+        for key, histogram in snapshot["histograms"].items():
+            previous_histogram = since["histograms"].get(key)
+            count = histogram["count"]
+            total = histogram["sum"]
+            buckets = histogram["buckets"]
+            if previous_histogram is not None:
+                count -= previous_histogram["count"]
+                total -= previous_histogram["sum"]
+                buckets = [
+                    bucket - previous_bucket
+                    for bucket, previous_bucket in zip(
+                        buckets, previous_histogram["buckets"]
+                    )
+                ]
+            if count == 0:
+                continue
+            name, labels = key
+            report["histograms"].setdefault(name, {})[format_labels(labels)] = {
+                "count": count,
+                "sum": round(total, 6),
+                "average": round(total / count, 6),
+                "buckets": {
+                    str(upper_bound): bucket
+                    for upper_bound, bucket in zip(DURATION_BUCKETS_SECS, buckets)
+                },
+            }
+        return report
+
+    def get_prometheus_text(self):
+        snapshot = self.get_snapshot()
+        lines = []
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            lines.append("%s%s %s" % (name, format_prometheus_labels(labels), value))
+        for (name, labels), histogram in sorted(snapshot["histograms"].items()):
+            for upper_bound, bucket in zip(DURATION_BUCKETS_SECS, histogram["buckets"]):
+                lines.append(
+                    "%s_bucket%s %s"
+                    % (
+                        name,
+                        format_prometheus_labels(labels + (("le", str(upper_bound)),)),
+                        bucket,
+                    )
+                )
+            lines.append(
+                "%s_bucket%s %s"
+                % (
+                    name,
+                    format_prometheus_labels(labels + (("le", "+Inf"),)),
+                    histogram["count"],
+                )
+            )
+            lines.append(
+                "%s_sum%s %s"
+                % (name, format_prometheus_labels(labels), histogram["sum"])
+            )
+            lines.append(
+                "%s_count%s %s"
+                % (name, format_prometheus_labels(labels), histogram["count"])
+            )
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    return ",".join("%s=%s" % (key, value) for key, value in labels)
+
+
+def format_prometheus_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '%s="%s"' % (key, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in labels
+        )
+        + "}"
+    )
+
+
+# Shared by all the clients, like the hosts' rate limiters
+metrics = Metrics()
+
+
+def write_run_report(file_path, report):
+    write_json_atomically(file_path, report, indent=4, ensure_ascii=False)
+    logger.info("The run report has been written to '{}'.", file_path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.get_prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    server = ThreadingHTTPServer(("", port), MetricsRequestHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics_server", daemon=True
+    )
+    thread.start()
+    logger.info("Serving the metrics on port {} at /metrics.", port)
+    return server
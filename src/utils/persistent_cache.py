@@ -0,0 +1,117 @@
+import json
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from utils.file_utils import make_parent_dirs
+
+
+class PersistentCache:
+    def __init__(self, file_path, table="entries", ttl_secs=0, max_entries=0):
+        self.file_path = file_path
+        self.table = table
+        # 0 means the entries never expire
+        self.ttl_secs = ttl_secs
+        # 0 means there is no size limit
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        make_parent_dirs(file_path)
+
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS %s ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)" % self.table
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS %s_accessed_at ON %s (accessed_at)"
+            % (self.table, self.table)
+        )
+        self.connection.commit()
+
+        self.evict()
+        logger.info(
+            "Loaded {} cached entries from '{}' ({}).",
+            self.count,
+            self.file_path,
+            self.table,
+        )
+
+    def is_expired(self, stored_at, now):
+        return self.ttl_secs > 0 and now - stored_at > self.ttl_secs
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, stored_at FROM %s WHERE key = ?" % self.table,
+                (str(key),),
+            ).fetchone()
+            if row is None:
+                return default
+            if self.is_expired(row[1], now):
+                self.connection.execute(
+                    "DELETE FROM %s WHERE key = ?" % self.table, (str(key),)
+                )
+                self.connection.commit()
+                self.count -= 1
+                return default
+            self.connection.execute(
+                "UPDATE %s SET accessed_at = ? WHERE key = ?" % self.table,
+                (now, str(key)),
+            )
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            exists = self.connection.execute(
+                "SELECT 1 FROM %s WHERE key = ?" % self.table, (str(key),)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT INTO %s (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = excluded.value, "
+                "stored_at = excluded.stored_at, "
+                "accessed_at = excluded.accessed_at" % self.table,
+                (str(key), json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self.connection.commit()
+            if exists is None:
+                self.count += 1
+        if self.max_entries > 0 and self.count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.ttl_secs > 0:
+                self.connection.execute(
+                    "DELETE FROM %s WHERE stored_at < ?" % self.table,
+                    (time.time() - self.ttl_secs,),
+                )
+            self.count = self.connection.execute(
+                "SELECT COUNT(*) FROM %s" % self.table
+            ).fetchone()[0]
+            if self.max_entries > 0 and self.count > self.max_entries:
+                # Drop the least recently used entries first, down to 90% of the limit so the inserts only evict once in a while
+                kept_entries = max(1, self.max_entries * 9 // 10)
+                self.connection.execute(
+                    "DELETE FROM %s WHERE key IN ("
+                    "SELECT key FROM %s ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)"
+                    % (self.table, self.table),
+                    (kept_entries,),
+                )
+                self.count = kept_entries
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
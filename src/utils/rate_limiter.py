@@ -0,0 +1,47 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1, jitter_secs=0.0):
+        # Tokens per second
+        self.rate = rate
+        self.burst = burst
+        # A random extra delay added to the requests that have to wait anyway
+        self.jitter_secs = jitter_secs
+        self.tokens = burst
+        self.last_refill_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_refill_time) * self.rate
+            )
+            self.last_refill_time = now
+            # Reserve the token even if it's not there yet, so the waiting callers are served in order
+            self.tokens -= 1
+            wait_secs = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait_secs > 0 and self.jitter_secs > 0:
+            wait_secs += random.uniform(0, self.jitter_secs)
+        return wait_secs
+
+    def acquire(self):
+        wait_secs = self.reserve()
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+        return wait_secs
+
+
+_host_rate_limiters = {}
+_host_rate_limiters_lock = threading.Lock()
+
+
+def get_host_rate_limiter(host, rate, burst=1, jitter_secs=0.0):
+    # All the clients talking to the same host share one bucket, the first one to ask decides its limits
+    with _host_rate_limiters_lock:
+        if host not in _host_rate_limiters:
+            _host_rate_limiters[host] = TokenBucket(rate, burst, jitter_secs)
+        return _host_rate_limiters[host]
@@ -1,112 +1,175 @@
-import datetime
-import random
 import time
+from urllib.parse import urlparse
 
 import requests
 import urllib3
+from loguru import logger
+
+from utils.metrics import metrics
+from utils.rate_limiter import get_host_rate_limiter
+from utils.retry_policy import RetryPolicy
+from utils.retry_policy import get_host_circuit_breaker
 
 
 class RequestUtils:
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    __last_request_time = None
 
     def __init__(
         self,
         request_interval_mode=False,
         max_attempt=6,
-        min_request_interval_in_ms=1000,
-        max_request_interval_in_ms=5000,
-        min_sleep_secs=1.0,
-        max_sleep_secs=10.0,
+        request_rate=1.0,
+        request_burst=1,
+        request_jitter_secs=0.0,
+        host_request_limits={},
+        retry_policy=None,
     ):
         self.request_interval_mode = request_interval_mode
         self.session = requests.Session()
         self.max_attempt = max_attempt
-        self.min_request_interval_in_ms = min_request_interval_in_ms
-        self.max_request_interval_in_ms = max_request_interval_in_ms
-        self.min_sleep_secs = min_sleep_secs
-        self.max_sleep_secs = max_sleep_secs
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempt=max_attempt)
+        self.retry_policy = retry_policy
+        # The default limits, in requests per second
+        self.request_limits = {
+            "rate": request_rate,
+            "burst": request_burst,
+            "jitter_secs": request_jitter_secs,
+        }
+        # The limits of specific hosts, e.g. {"musicbrainz.org": {"rate": 1.0}}
+        self.host_request_limits = host_request_limits
+
+    def get_rate_limiter(self, url):
+        host = urlparse(url).netloc
+        request_limits = dict(self.request_limits)
+        request_limits.update(self.host_request_limits.get(host, {}))
+        return get_host_rate_limiter(
+            host,
+            request_limits["rate"],
+            request_limits["burst"],
+            request_limits["jitter_secs"],
+        )
 
-    def check_request(self):
+    def check_request(self, url):
         if not self.request_interval_mode:
             return
-        if self.__last_request_time is None:
-            self.__last_request_time = datetime.datetime.now()
-            return
-        time_since_last_request = datetime.datetime.now() - self.__last_request_time
-        time_since_last_request_ms = time_since_last_request.microseconds / 1000
-        if time_since_last_request_ms < random.randint(
-            self.min_request_interval_in_ms, self.max_request_interval_in_ms
-        ):
-            min_sleep_secs = self.min_sleep_secs
-            max_sleep_secs = self.max_sleep_secs - (time_since_last_request_ms / 1000)
-            if max_sleep_secs <= min_sleep_secs:
-                max_sleep_secs = min_sleep_secs * 2
-            sleep_secs = random.uniform(self.min_sleep_secs, self.max_sleep_secs)
-            time.sleep(sleep_secs)
-        self.__last_request_time = datetime.datetime.now()
+        wait_secs = self.get_rate_limiter(url).acquire()
+        if wait_secs > 0:
+            metrics.increase(
+                "rate_limit_wait_seconds_total", wait_secs, host=urlparse(url).netloc
+            )
 
-    def post_and_return_content(self, url, params, headers={}):
-        i = 0
-        while i < self.max_attempt:
+    def send(self, method, url, **kwargs):
+        self.check_request(url)
+        return self.send_request(method, url, **kwargs)
+
+    def send_request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        started_at = time.perf_counter()
+        try:
+            r = self.session.request(method, url, verify=False, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.increase("http_requests_total", host=host, status="error")
+            raise
+        finally:
+            metrics.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - started_at,
+                host=host,
+            )
+        metrics.increase("http_requests_total", host=host, status=r.status_code)
+        return r
+
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while self.allow_request(method, url):
+            r = None
+            error = None
             try:
-                self.check_request()
-                r = self.session.post(url, data=params, verify=False, headers=headers)
-                return str(r.content, "UTF-8")
-            except self.session.exceptions.RequestException:
-                i += 1
+                r = self.send(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            backoff_secs = self.get_retry_backoff_secs(method, url, attempt, r, error)
+            if backoff_secs is None:
+                return r
+            time.sleep(backoff_secs)
+            attempt += 1
+        return None
+
+    def allow_request(self, method, url):
+        host = urlparse(url).netloc
+        if get_host_circuit_breaker(host).allow_request():
+            return True
+        # Failing fast, the host has been failing and will be retried after a while
+        logger.warning(
+            "Skipped {} {}, the requests to {} are paused.", method, url, host
+        )
+        metrics.increase("http_requests_short_circuited_total", host=host)
+        return False
+
+    def get_retry_backoff_secs(self, method, url, attempt, r, error):
+        # Returns how long to wait before retrying, or None if the request is done with
+        host = urlparse(url).netloc
+        circuit_breaker = get_host_circuit_breaker(host)
+        if r is not None and not self.retry_policy.is_failure(r):
+            circuit_breaker.record_success()
+            return None
+        if circuit_breaker.record_failure():
+            logger.warning(
+                "Too many failed requests to {}, pausing them for {} seconds.",
+                host,
+                circuit_breaker.reset_timeout_secs,
+            )
+            metrics.increase("circuit_breaker_opened_total", host=host)
+        failure = error if r is None else "status %s" % r.status_code
+        if not self.retry_policy.is_retryable(method, r, error):
+            logger.error("{} {} failed: {}, not retrying it.", method, url, failure)
+            return None
+        if attempt + 1 >= self.retry_policy.max_attempt:
+            logger.error(
+                "Gave up on {} {} after {} attempts: {}",
+                method,
+                url,
+                attempt + 1,
+                failure,
+            )
+            return None
+        backoff_secs = self.retry_policy.get_backoff_secs(attempt, r)
+        logger.warning(
+            "{} {} failed: {}, retrying in {:.1f} seconds.",
+            method,
+            url,
+            failure,
+            backoff_secs,
+        )
+        metrics.increase("http_request_retries_total", host=host)
+        metrics.increase("http_retry_backoff_seconds_total", backoff_secs, host=host)
+        return backoff_secs
+
+    def post_and_return_content(self, url, params, headers={}):
+        r = self.request("POST", url, data=params, headers=headers)
+        if r is not None:
+            return str(r.content, "UTF-8")
 
     def get_and_return_content(self, url, params=None, headers=None):
-        i = 0
-        while i < self.max_attempt:
-            try:
-                self.check_request()
-                r = self.session.get(url, verify=False, headers=headers, params=params)
-                return str(r.content, "UTF-8")
-            except requests.exceptions.RequestException:
-                i += 1
+        r = self.request("GET", url, headers=headers, params=params)
+        if r is not None:
+            return str(r.content, "UTF-8")
 
     def get(self, url, params=None, headers={}):
-        i = 0
-        while i < self.max_attempt:
-            try:
-                self.check_request()
-                return self.session.get(
-                    url, params=params, verify=False, headers=headers
-                )
-            except requests.exceptions.RequestException as e:
-                print(e)
-                i += 1
+        return self.request("GET", url, params=params, headers=headers)
 
     def post(self, url, params=None, data=None, headers={}, allow_redirects=True):
-        i = 0
-        while i < self.max_attempt:
-            try:
-                self.check_request()
-                return self.session.post(
-                    url,
-                    data=data,
-                    params=params,
-                    verify=False,
-                    headers=headers,
-                    allow_redirects=allow_redirects,
-                )
-            except requests.exceptions.RequestException as e:
-                print(e)
-                i += 1
+        return self.request(
+            "POST",
+            url,
+            data=data,
+            params=params,
+            headers=headers,
+            allow_redirects=allow_redirects,
+        )
 
     def put(self, url, data=None, headers={}, allow_redirects=True):
-        i = 0
-        while i < self.max_attempt:
-            try:
-                self.check_request()
-                return self.session.put(
-                    url,
-                    data=data,
-                    verify=False,
-                    headers=headers,
-                    allow_redirects=allow_redirects,
-                )
-            except requests.exceptions.RequestException as e:
-                print(e)
-                i += 1
+        return self.request(
+            "PUT", url, data=data, headers=headers, allow_redirects=allow_redirects
+        )
@@ -0,0 +1,123 @@
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+# The requests sent again only if the server couldn't have acted on them, e.g. a POST adding an item would add it twice
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempt=6,
+        backoff_base_secs=1.0,
+        backoff_max_secs=60.0,
+        retry_status_codes=(429, 500, 502, 503, 504),
+        non_idempotent_retry_status_codes=(429,),
+        failure_status_codes=(),
+        max_retry_after_secs=300.0,
+    ):
+        self.max_attempt = max_attempt
+        self.backoff_base_secs = backoff_base_secs
+        self.backoff_max_secs = backoff_max_secs
+        self.retry_status_codes = retry_status_codes
+        # The statuses telling the request was turned away before being processed
+        self.non_idempotent_retry_status_codes = non_idempotent_retry_status_codes
+        # Counted as the host failing but never retried, e.g. the pages a banned client is sent
+        self.failure_status_codes = failure_status_codes
+        # A server asking for a longer break than this is retried after this long anyway
+        self.max_retry_after_secs = max_retry_after_secs
+
+    def is_failure(self, response):
+        return (
+            response.status_code in self.retry_status_codes
+            or response.status_code in self.failure_status_codes
+        )
+
+    def is_retryable(self, method, response=None, error=None):
+        if method.upper() in IDEMPOTENT_METHODS:
+            return response is None or response.status_code in self.retry_status_codes
+        # Only a connection never made is sure not to have reached the server
+        if response is None:
+            return isinstance(error, requests.exceptions.ConnectTimeout)
+        return response.status_code in self.non_idempotent_retry_status_codes
+
+    def get_backoff_secs(self, attempt, response=None):
+        # The server knows best when it's ready again
+        if response is not None:
+            retry_after_secs = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after_secs is not None:
+                return min(retry_after_secs, self.max_retry_after_secs)
+        # Exponential backoff with full jitter, so the workers hitting the same host don't retry in lockstep
+        return random.uniform(
+            0, min(self.backoff_max_secs, self.backoff_base_secs * 2**attempt)
+        )
+
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout_secs=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_secs = reset_timeout_secs
+        self.failure_count = 0
+        # When the circuit was opened, None if it's closed
+        self.opened_at = None
+        self.is_probing = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout_secs:
+                return False
+            # Half-open, a single request finds out if the host has recovered
+            if self.is_probing:
+                return False
+            self.is_probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failure_count = 0
+            self.opened_at = None
+            self.is_probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failure_count += 1
+            self.is_probing = False
+            if self.failure_count >= self.failure_threshold:
+                is_opening = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return is_opening
+            return False
+
+
+_host_circuit_breakers = {}
+_host_circuit_breakers_lock = threading.Lock()
+
+
+def get_host_circuit_breaker(host, failure_threshold=5, reset_timeout_secs=60.0):
+    # Shared by all the clients talking to the same host, like the rate limiters
+    with _host_circuit_breakers_lock:
+        if host not in _host_circuit_breakers:
+            _host_circuit_breakers[host] = CircuitBreaker(
+                failure_threshold, reset_timeout_secs
+            )
+        return _host_circuit_breakers[host]
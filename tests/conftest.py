@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other from the src folder, like when running "python src"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
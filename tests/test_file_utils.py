@@ -0,0 +1,19 @@
+import os
+
+from utils.file_utils import load_json
+from utils.file_utils import write_json_atomically
+
+
+def test_write_and_load(tmp_path):
+    file_path = os.path.join(str(tmp_path), "state", "records.json")
+    write_json_atomically(file_path, {"a": [1, 2]}, indent=4)
+    assert load_json(file_path, {}, "the records") == {"a": [1, 2]}
+    assert os.listdir(os.path.dirname(file_path)) == ["records.json"]
+
+
+def test_missing_or_broken_file_loads_the_default(tmp_path):
+    file_path = os.path.join(str(tmp_path), "records.json")
+    assert load_json(file_path, {}, "the records") == {}
+    with open(file_path, "w") as file:
+        file.write('{"a": ')
+    assert load_json(file_path, None, "the records") is None
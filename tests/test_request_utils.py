@@ -0,0 +1,83 @@
+import requests
+
+from utils.request_utils import RequestUtils
+from utils.retry_policy import RetryPolicy
+from utils.retry_policy import get_host_circuit_breaker
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeRequestUtils(RequestUtils):
+    def __init__(self, outcomes, **kwargs):
+        RequestUtils.__init__(self, **kwargs)
+        self.outcomes = list(outcomes)
+        self.sent_count = 0
+
+    def send_request(self, method, url, **kwargs):
+        self.sent_count += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+def create_policy(**kwargs):
+    return RetryPolicy(backoff_base_secs=0, backoff_max_secs=0, **kwargs)
+
+
+def test_get_is_retried_on_5xx():
+    request_utils = FakeRequestUtils([503, 200], retry_policy=create_policy())
+    r = request_utils.request("GET", "http://get.example/")
+    assert r.status_code == 200
+    assert request_utils.sent_count == 2
+
+
+def test_post_is_not_retried_on_5xx():
+    request_utils = FakeRequestUtils([503, 201], retry_policy=create_policy())
+    r = request_utils.request("POST", "http://post.example/")
+    assert r.status_code == 503
+    assert request_utils.sent_count == 1
+    assert get_host_circuit_breaker("post.example").failure_count == 1
+
+
+def test_post_is_retried_on_429_and_connect_timeout():
+    request_utils = FakeRequestUtils(
+        [429, requests.exceptions.ConnectTimeout(), 201], retry_policy=create_policy()
+    )
+    r = request_utils.request("POST", "http://post-retried.example/")
+    assert r.status_code == 201
+    assert request_utils.sent_count == 3
+
+
+def test_post_is_not_retried_on_read_timeout():
+    request_utils = FakeRequestUtils(
+        [requests.exceptions.ReadTimeout(), 201], retry_policy=create_policy()
+    )
+    assert request_utils.request("POST", "http://post-timeout.example/") is None
+    assert request_utils.sent_count == 1
+
+
+def test_failure_status_counts_against_the_host_without_retrying():
+    request_utils = FakeRequestUtils(
+        [403, 418], retry_policy=create_policy(failure_status_codes=(403, 418))
+    )
+    circuit_breaker = get_host_circuit_breaker("movie.douban.example")
+    assert (
+        request_utils.request("GET", "http://movie.douban.example/").status_code == 403
+    )
+    assert (
+        request_utils.request("GET", "http://movie.douban.example/").status_code == 418
+    )
+    assert request_utils.sent_count == 2
+    assert circuit_breaker.failure_count == 2
+
+
+def test_other_client_errors_count_as_successes():
+    request_utils = FakeRequestUtils([403], retry_policy=create_policy())
+    r = request_utils.request("GET", "http://forbidden.example/")
+    assert r.status_code == 403
+    assert get_host_circuit_breaker("forbidden.example").failure_count == 0
@@ -0,0 +1,150 @@
+import datetime
+
+from douban.scraping_state import ScrapingState
+
+USER = "user"
+CATEGORY = "movie"
+LIST_TYPE = "wish"
+
+
+def get_ordinal(date_str):
+    return datetime.date.fromisoformat(date_str).toordinal()
+
+
+def get_added_dates(*entries):
+    # (id, date) pairs, the newest first like on the list pages
+    return {id: get_ordinal(date_str) for id, date_str in entries}
+
+
+def create_state(tmp_path, **kwargs):
+    return ScrapingState(str(tmp_path / "scraping_state.json"), **kwargs)
+
+
+def test_unknown_list_is_scraped_to_the_end(tmp_path):
+    state = create_state(tmp_path)
+    assert not state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2000-01-01")
+    assert not state.is_seen(USER, CATEGORY, LIST_TYPE, "1")
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE) == []
+
+
+def test_completed_list_stops_before_the_newest_date(tmp_path):
+    state = create_state(tmp_path)
+    added_dates = get_added_dates(
+        ("3", "2024-05-03"), ("2", "2024-05-03"), ("1", "2024-05-01")
+    )
+    state.update(USER, CATEGORY, LIST_TYPE, added_dates, {"1", "2", "3"})
+
+    assert state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-02")
+    assert not state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-03")
+    # Only the entries on the watermark's date could show up again
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "2")
+    assert not state.is_seen(USER, CATEGORY, LIST_TYPE, "1")
+    assert not state.is_seen(USER, CATEGORY, LIST_TYPE, "4")
+
+
+def test_failed_entry_does_not_hold_the_watermark_back(tmp_path):
+    state = create_state(tmp_path, retry_backoff_base_secs=60.0)
+    added_dates = get_added_dates(("3", "2024-05-03"), ("1", "2024-05-01"))
+    state.update(USER, CATEGORY, LIST_TYPE, added_dates, {"3"}, now=1000.0)
+
+    assert state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-02")
+    # The failed entry is retried by its id instead of by the pages
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "1")
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE, now=1059.0) == []
+    retry_entries = state.get_retry_entries(USER, CATEGORY, LIST_TYPE, now=1060.0)
+    assert [entry.id for entry in retry_entries] == ["1"]
+    assert retry_entries[0].added_date_str == "2024-05-01"
+
+
+def test_retried_entry_backs_off_and_is_dropped_once_completed(tmp_path):
+    state = create_state(tmp_path, retry_backoff_base_secs=60.0)
+    state.update(
+        USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), set(), 0.0
+    )
+    state.update(
+        USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), set(), 60.0
+    )
+    # The second failure waits twice as long
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE, now=179.0) == []
+    assert len(state.get_retry_entries(USER, CATEGORY, LIST_TYPE, now=180.0)) == 1
+
+    state.update(
+        USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), {"1"}, 180.0
+    )
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE, now=1e9) == []
+    # Seen on the watermark's date now
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "1")
+    assert state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-04-30")
+
+
+def test_entry_is_given_up_on_after_max_attempts(tmp_path):
+    state = create_state(tmp_path, max_attempts=2, retry_backoff_base_secs=0.0)
+    for _ in range(2):
+        state.update(
+            USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), set()
+        )
+    assert len(state.get_retry_entries(USER, CATEGORY, LIST_TYPE)) == 1
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), set())
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE) == []
+    assert not state.is_seen(USER, CATEGORY, LIST_TYPE, "1")
+
+
+def test_seen_ids_are_kept_while_the_watermark_stays(tmp_path):
+    state = create_state(tmp_path)
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("2", "2024-05-03")), {"2"})
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("3", "2024-05-03")), {"3"})
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "2")
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+
+    # A newer date moves the watermark, the older seen ids aren't needed anymore
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("4", "2024-05-04")), {"4"})
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "4")
+    assert not state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+    assert state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-03")
+
+
+def test_retried_old_entries_do_not_move_the_watermark_back(tmp_path):
+    state = create_state(tmp_path, retry_backoff_base_secs=0.0)
+    state.update(
+        USER,
+        CATEGORY,
+        LIST_TYPE,
+        get_added_dates(("3", "2024-05-03"), ("1", "2024-05-01")),
+        {"3"},
+    )
+    # A run with no new entries only retries the failed one
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("1", "2024-05-01")), {"1"})
+    assert state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-02")
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+
+
+def test_state_is_saved_and_loaded(tmp_path):
+    state = create_state(tmp_path, retry_backoff_base_secs=0.0)
+    state.update(
+        USER,
+        CATEGORY,
+        LIST_TYPE,
+        get_added_dates(("3", "2024-05-03"), ("1", "2024-05-01")),
+        {"3"},
+    )
+    state.save()
+
+    loaded_state = create_state(tmp_path)
+    assert loaded_state.is_scraped_before(USER, CATEGORY, LIST_TYPE, "2024-05-02")
+    assert loaded_state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+    assert [
+        entry.id for entry in loaded_state.get_retry_entries(USER, CATEGORY, LIST_TYPE)
+    ] == ["1"]
+
+
+def test_state_written_before_the_retries_is_loaded(tmp_path):
+    (tmp_path / "scraping_state.json").write_text(
+        '{"user/movie/wish": {"newest_added_date": "2024-05-03", "seen_ids": ["3"]}}',
+        encoding="utf-8",
+    )
+    state = create_state(tmp_path)
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "3")
+    assert state.get_retry_entries(USER, CATEGORY, LIST_TYPE) == []
+    state.update(USER, CATEGORY, LIST_TYPE, get_added_dates(("4", "2024-05-04")), set())
+    assert state.is_seen(USER, CATEGORY, LIST_TYPE, "4")